@@ -1,9 +1,11 @@
 import logging
+from agents.tracing import current_span, get_tracer
 
 class Agent:
     """
     An abstract superclass for Agents
-    Used to log messages in a way that can identify each Agent
+    Used to log messages in a way that can identify each Agent,
+    and to trace how long each Agent's operations take
     """
 
     # Foreground colors
@@ -30,4 +32,18 @@ class Agent:
         """
         color_code = self.BG_BLACK + self.color
         message = f"[{self.name}] {message}"
-        logging.info(color_code + message + self.RESET)
\ No newline at end of file
+        logging.info(color_code + message + self.RESET)
+
+    def span(self, operation: str, **sizes):
+        """
+        Trace an operation of this agent as a with-block, nested inside the span already open
+        """
+        return get_tracer().span(self.name, operation, **sizes)
+
+    def trace(self, **sizes):
+        """
+        Record sizes, such as token counts or numbers of deals, on the span currently open
+        """
+        span = current_span()
+        if span:
+            span.set(**sizes)
@@ -0,0 +1,97 @@
+import os
+import json
+import numpy as np
+
+FOREST_DIR = "random_forest_arrays"
+SOURCE_FILENAME = "random_forest_model.pkl"
+# The size and modification time of the pickle the arrays were converted from
+FINGERPRINT_FILENAME = "source.json"
+ARRAYS = ["roots", "children_left", "children_right", "feature", "threshold", "value"]
+LEAF = -1
+
+
+def fingerprint(filename: str) -> dict:
+    """
+    Return the size and modification time of a file, enough to notice when it has been replaced
+    """
+    stat = os.stat(filename)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def convert(model, directory: str = FOREST_DIR, source: str = SOURCE_FILENAME) -> None:
+    """
+    Flatten a fitted sklearn RandomForestRegressor into contiguous NumPy node arrays, one .npy file per array
+    The nodes of every tree are concatenated, with child indices offset to point into the combined arrays
+    :param model: the fitted forest, for example from joblib.load('random_forest_model.pkl')
+    :param directory: the folder to write the arrays to
+    :param source: the pickle the model was loaded from, whose fingerprint is saved so stale arrays can be detected
+    """
+    trees = [estimator.tree_ for estimator in model.estimators_]
+    counts = np.array([tree.node_count for tree in trees])
+    roots = np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(np.int64)
+
+    def children(root, side):
+        child = side.astype(np.int64)
+        return np.where(child == LEAF, LEAF, child + root)
+
+    arrays = {
+        "roots": roots,
+        "children_left": np.concatenate([children(r, t.children_left) for t, r in zip(trees, roots)]),
+        "children_right": np.concatenate([children(r, t.children_right) for t, r in zip(trees, roots)]),
+        "feature": np.concatenate([np.maximum(t.feature, 0) for t in trees]).astype(np.int32),
+        "threshold": np.concatenate([t.threshold for t in trees]).astype(np.float64),
+        "value": np.concatenate([t.value[:, 0, 0] for t in trees]).astype(np.float64),
+    }
+    os.makedirs(directory, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(os.path.join(directory, f"{name}.npy"), np.ascontiguousarray(array))
+    with open(os.path.join(directory, FINGERPRINT_FILENAME), "w") as file:
+        json.dump(fingerprint(source) if os.path.exists(source) else {}, file)
+
+
+class ArrayForest:
+    """
+    A random forest regressor backed by the flat node arrays written by convert,
+    loaded as memory maps so that startup is nearly free and pages are shared between processes
+    Predicts a whole batch at once by walking every tree for every row in lockstep
+    """
+
+    def __init__(self, directory: str = FOREST_DIR, mmap: bool = True):
+        """
+        :param directory: the folder holding the arrays
+        :param mmap: memory map the arrays rather than reading them into memory
+        """
+        mode = "r" if mmap else None
+        for name in ARRAYS:
+            setattr(self, name, np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mode))
+
+    @staticmethod
+    def exists(directory: str = FOREST_DIR, source: str = SOURCE_FILENAME) -> bool:
+        """
+        Return whether the arrays have been written and are up to date,
+        that is converted from the pickle as it is now, if the pickle is still there
+        """
+        files = [f"{name}.npy" for name in ARRAYS] + [FINGERPRINT_FILENAME]
+        if not all(os.path.exists(os.path.join(directory, file)) for file in files):
+            return False
+        if not os.path.exists(source):
+            return True
+        with open(os.path.join(directory, FINGERPRINT_FILENAME)) as file:
+            return json.load(file) == fingerprint(source)
+
+    def predict(self, X) -> np.ndarray:
+        """
+        Return the forest's prediction for each row of X, the mean of its trees as in sklearn
+        Features are compared in float32, as sklearn does
+        """
+        X = np.asarray(X, dtype=np.float32)
+        rows = np.arange(len(X))[:, None]
+        nodes = np.broadcast_to(self.roots, (len(X), len(self.roots))).copy()
+        while True:
+            left = self.children_left[nodes]
+            leaf = left == LEAF
+            if leaf.all():
+                break
+            go_left = X[rows, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(leaf, nodes, np.where(go_left, left, self.children_right[nodes]))
+        return self.value[nodes].mean(axis=1)
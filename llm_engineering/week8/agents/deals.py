@@ -1,11 +1,18 @@
 from pydantic import BaseModel
-from typing import List, Dict, Self
+from typing import List, Dict, Container, Iterable, Iterator, Optional, Self
 from bs4 import BeautifulSoup
 import re
+import logging
 import feedparser
 from tqdm import tqdm
 import requests
 import time
+import threading
+import hashlib
+import os
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from agents.http_cache import HttpCache
 
 feeds = [
     "https://www.dealnews.com/c142/Electronics/?rss=1",
@@ -15,6 +22,94 @@ feeds = [
         "https://www.dealnews.com/c196/Home-Garden/?rss=1",
        ]
 
+MAX_WORKERS = 8
+REQUESTS_PER_SECOND = 4.0
+TIMEOUT = 20
+ENTRIES_PER_FEED = 10
+
+class RateLimiter:
+    """
+    A thread-safe limiter that spaces out requests to the same host,
+    so that concurrent workers stay polite to each site
+    """
+
+    def __init__(self, requests_per_second: float = REQUESTS_PER_SECOND):
+        """
+        :param requests_per_second: the maximum rate of requests allowed per host
+        """
+        self.interval = 1.0 / requests_per_second if requests_per_second > 0 else 0.0
+        self.next_slot = {}
+        self.lock = threading.Lock()
+
+    def wait(self, url: str) -> None:
+        """
+        Block until a request to the host of this url is allowed
+        """
+        host = urlparse(url).netloc
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+def make_session(max_workers: int = MAX_WORKERS) -> requests.Session:
+    """
+    Create a requests Session with a keep-alive connection pool big enough for our workers
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=len(feeds), pool_maxsize=max_workers)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+class SeenIndex:
+    """
+    A hashed index of deal URLs that have already been surfaced
+    Persisted as an append-only file of URL hashes so it survives across runs
+    """
+
+    def __init__(self, filename: Optional[str] = None):
+        """
+        :param filename: the file to persist the index to, or None to keep it in memory only
+        """
+        self.filename = filename
+        self.hashes = set()
+        self.lock = threading.Lock()
+        if filename and os.path.exists(filename):
+            with open(filename, "r") as file:
+                self.hashes = {line.strip() for line in file if line.strip()}
+
+    @staticmethod
+    def key(url: str) -> str:
+        """
+        Return the hash used to index this url
+        """
+        return hashlib.sha1(url.encode("utf-8")).hexdigest()
+
+    def __contains__(self, url: str) -> bool:
+        return self.key(url) in self.hashes
+
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+    def update(self, urls: Iterable[str]) -> int:
+        """
+        Add these urls to the index, appending any new ones to the file
+        :return: the number of urls that were not already in the index
+        """
+        with self.lock:
+            new = []
+            for url in urls:
+                key = self.key(url)
+                if key not in self.hashes:
+                    self.hashes.add(key)
+                    new.append(key)
+            if new and self.filename:
+                with open(self.filename, "a") as file:
+                    file.writelines(key + "\n" for key in new)
+        return len(new)
+
 def extract(html_snippet: str) -> str:
     """
     Use Beautiful Soup to clean up this HTML snippet and extract useful text
@@ -31,6 +126,33 @@ def extract(html_snippet: str) -> str:
         result = html_snippet
     return result.replace('\n', ' ')
 
+# A dollar amount, like $1,299 or $19.99
+PRICE_PATTERN = re.compile(r"\$\s?(\d{1,3}(?:,\d{3})+|\d+)(\.\d{1,2})?")
+# Words around a dollar amount that show it isn't the price of the product, like "$50 off" or "save $50"
+# Store rewards such as "$20 Kohl's Cash" may have a store name between the amount and the reward
+NOT_A_PRICE_AFTER = re.compile(r"^\s*(?:(?:[\w'.-]+\s+)?(?:cash|rewards?|credits?|points|bucks)|off|less|discount|savings|rebate|credit|gift|coupon|back"
+                               r"|or more|and up|minimum|min\.?|orders?|purchases?|spend)\b", re.IGNORECASE)
+NOT_A_PRICE_BEFORE = re.compile(r"(?:save|saving|reduced by|drops? by|cut by|up to|over|under|from|starting at|spend|orders? of|extra|get a|get|coupon|credit|bonus|w/|with|\+)\s*$", re.IGNORECASE)
+# A dollar amount with the deal wording around it, like "for $189" or "$60 off", and sentences about the terms of a deal
+DEAL_AMOUNT = re.compile(r"(?:\b(?:for|at|only|just|now|from)\s+)?\$\s?[\d,]+(?:\.\d{1,2})?(?:\s+(?:off|less))?", re.IGNORECASE)
+DEAL_TERMS = re.compile(r"\b(?:free shipping|ships free|shipping|coupon|promo|code|list price|lowest price|save|saving|savings|discount"
+                        r"|rebate|cash|w/|orders?|purchases?|in cart|at checkout|clearance|sale|deal|price)\b|\d+%\s*off", re.IGNORECASE)
+
+def explicit_price(text: str) -> Optional[float]:
+    """
+    Return the first dollar amount in this text that reads like the price of the product,
+    skipping amounts that are discounts, coupons or thresholds such as "$50 off" or "orders over $35"
+    """
+    for match in PRICE_PATTERN.finditer(text):
+        before = text[max(0, match.start() - 20):match.start()]
+        after = text[match.end():match.end() + 15]
+        if NOT_A_PRICE_AFTER.search(after) or NOT_A_PRICE_BEFORE.search(before):
+            continue
+        price = float(match.group(1).replace(",", "") + (match.group(2) or ""))
+        if price > 0:
+            return price
+    return None
+
 class ScrapedDeal:
     """
     A class to represent a Deal retrieved from an RSS feed
@@ -42,14 +164,20 @@ class ScrapedDeal:
     details: str
     features: str
 
-    def __init__(self, entry: Dict[str, str]):
+    def __init__(self, entry: Dict[str, str], session: Optional[requests.Session] = None, cache: Optional[HttpCache] = None):
         """
         Populate this instance based on the provided dict
+        :param entry: an entry from an RSS feed
+        :param session: an optional Session to reuse keep-alive connections
+        :param cache: an optional HttpCache to revalidate the deal page against
         """
         self.title = entry['title']
         self.summary = extract(entry['summary'])
         self.url = entry['links'][0]['href']
-        stuff = requests.get(self.url).content
+        if cache:
+            stuff = cache.get(self.url, session=session, timeout=TIMEOUT)
+        else:
+            stuff = (session or requests).get(self.url, timeout=TIMEOUT).content
         soup = BeautifulSoup(stuff, 'html.parser')
         content = soup.find('div', class_='content-section').get_text()
         content = content.replace('\nmore', '').replace('\n', ' ')
@@ -71,19 +199,91 @@ class ScrapedDeal:
         """
         return f"Title: {self.title}\nDetails: {self.details.strip()}\nFeatures: {self.features.strip()}\nURL: {self.url}"
 
+    def explicit_price(self) -> Optional[float]:
+        """
+        Return the price stated in the title, or failing that the summary, if there is a clear one
+        """
+        price = explicit_price(self.title)
+        return price if price is not None else explicit_price(self.summary)
+
+    def richness(self) -> int:
+        """
+        Score how much there is to say about the product: the number of words in its details and features
+        """
+        return len(self.details.split()) + len(self.features.split())
+
+    def summarize(self, sentences: int = 5) -> str:
+        """
+        Return a short product description made from the title and the first few sentences of the details,
+        keeping prices and the terms of the deal out of it, as the scanner's prompt asks the model to,
+        so the pricing Agents aren't anchored on the listed price
+        """
+        title = re.split(r"\s+(?:\+|w/)\s+", self.title)[0]
+        title = re.sub(r"\s{2,}", " ", DEAL_AMOUNT.sub("", title)).strip(" ,;:-")
+        kept = [sentence for sentence in re.split(r"(?<=[.!?])\s+", self.details.strip())
+                if sentence and not PRICE_PATTERN.search(sentence) and not DEAL_TERMS.search(sentence)]
+        details = " ".join(kept[:sentences])
+        return f"{title}. {details}"
+
     @classmethod
-    def fetch(cls, show_progress : bool = False) -> List[Self]:
+    def fetch(cls, show_progress : bool = False, max_workers: int = MAX_WORKERS,
+              requests_per_second: float = REQUESTS_PER_SECOND, seen: Optional[Container[str]] = None,
+              cache: Optional[HttpCache] = None) -> List[Self]:
         """
         Retrieve all deals from the selected RSS feeds
+        Feeds and deal pages are downloaded concurrently over a shared keep-alive Session,
+        with a per-host RateLimiter in place of a fixed sleep between requests
+        :param show_progress: show a progress bar over the deal pages
+        :param max_workers: the number of concurrent downloads; 1 fetches one at a time
+        :param requests_per_second: the maximum rate of requests to each host
+        :param seen: an index of urls, such as a SeenIndex, to skip before their deal pages are downloaded
+        :param cache: an optional HttpCache used for conditional GETs of feeds and pages
+        :return: the deals in feed order
+        """
+        return list(cls.stream(show_progress, max_workers, requests_per_second, seen, cache, ordered=True))
+
+    @classmethod
+    def stream(cls, show_progress : bool = False, max_workers: int = MAX_WORKERS,
+               requests_per_second: float = REQUESTS_PER_SECOND, seen: Optional[Container[str]] = None,
+               cache: Optional[HttpCache] = None, ordered: bool = False) -> Iterator[Self]:
+        """
+        Like fetch, but yield each deal as soon as its page has been scraped,
+        so that later stages can start before the whole scrape is done
+        :param ordered: yield in feed order rather than in the order pages complete
         """
-        deals = []
-        feed_iter = tqdm(feeds) if show_progress else feeds
-        for feed_url in feed_iter:
-            feed = feedparser.parse(feed_url)
-            for entry in feed.entries[:10]:
-                deals.append(cls(entry))
-                time.sleep(0.5)
-        return deals
+        session = make_session(max_workers)
+        limiter = RateLimiter(requests_per_second)
+
+        def parse_feed(feed_url):
+            limiter.wait(feed_url)
+            if cache:
+                content = cache.get(feed_url, session=session, timeout=TIMEOUT)
+            else:
+                content = session.get(feed_url, timeout=TIMEOUT).content
+            return feedparser.parse(content).entries[:ENTRIES_PER_FEED]
+
+        def scrape(entry):
+            limiter.wait(entry['links'][0]['href'])
+            try:
+                return cls(entry, session=session, cache=cache)
+            except Exception as e:
+                logging.warning(f"Unable to scrape deal {entry.get('title')}: {e}")
+                return None
+
+        with session, ThreadPoolExecutor(max_workers=max_workers) as executor:
+            entries = [entry for feed_entries in executor.map(parse_feed, feeds) for entry in feed_entries]
+            if seen is not None:
+                entries = [entry for entry in entries if entry['links'][0]['href'] not in seen]
+            futures = [executor.submit(scrape, entry) for entry in entries]
+            results = (future.result() for future in (futures if ordered else as_completed(futures)))
+            if show_progress:
+                results = tqdm(results, total=len(entries))
+            for deal in results:
+                if deal:
+                    yield deal
+        if cache:
+            logging.info(f"HTTP cache has served {cache.hits} responses from disk and fetched {cache.misses} so far")
+            cache.evict()
 
 class Deal(BaseModel):
     """
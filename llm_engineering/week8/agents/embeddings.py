@@ -0,0 +1,102 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import List, Optional
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+MODEL_NAME = 'sentence-transformers/all-MiniLM-L6-v2'
+CACHE_SIZE = 4096
+
+
+class Embedder:
+    """
+    A SentenceTransformer shared across Agents, with a bounded LRU cache of vectors
+    keyed by a hash of the text, so that each description is only encoded once
+    A text that another thread is already encoding is waited for rather than encoded again
+    """
+
+    def __init__(self, model_name: str = MODEL_NAME, cache_size: int = CACHE_SIZE):
+        """
+        :param model_name: the SentenceTransformer model to load
+        :param cache_size: the maximum number of vectors to keep
+        """
+        self.model = SentenceTransformer(model_name)
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.pending = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(text: str) -> str:
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """
+        Return a matrix with one vector per text, in the same order
+        Only texts missing from the cache are sent to the model, in a single call;
+        texts already being encoded by another call are waited for instead
+        """
+        keys = [self.key(text) for text in texts]
+        vectors = {}
+        missing = {}
+        waiting = {}
+        with self.lock:
+            for key, text in zip(keys, texts):
+                if key in vectors or key in missing or key in waiting:
+                    continue
+                if key in self.cache:
+                    self.cache.move_to_end(key)
+                    vectors[key] = self.cache[key]
+                    self.hits += 1
+                elif key in self.pending:
+                    waiting[key] = self.pending[key]
+                    self.hits += 1
+                else:
+                    missing[key] = text
+                    self.pending[key] = Future()
+                    self.misses += 1
+        if missing:
+            try:
+                encoded = self.model.encode(list(missing.values()))
+            except BaseException as e:
+                with self.lock:
+                    for key in missing:
+                        self.pending.pop(key).set_exception(e)
+                raise
+            with self.lock:
+                for key, vector in zip(missing, encoded):
+                    vectors[key] = vector
+                    self.cache[key] = vector
+                    self.cache.move_to_end(key)
+                    self.pending.pop(key).set_result(vector)
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        for key, future in waiting.items():
+            vectors[key] = future.result()
+        return np.array([vectors[key] for key in keys])
+
+    def stats(self) -> dict:
+        """
+        Return the cache hit and miss counters
+        """
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self.cache)}
+
+
+_embedder: Optional[Embedder] = None
+_embedder_lock = threading.Lock()
+
+
+def get_embedder() -> Embedder:
+    """
+    Return the process-wide Embedder, loading the model the first time it's needed
+    """
+    global _embedder
+    with _embedder_lock:
+        if _embedder is None:
+            _embedder = Embedder()
+        return _embedder
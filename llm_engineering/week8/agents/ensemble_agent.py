@@ -1,48 +1,240 @@
-import pandas as pd
-from sklearn.linear_model import LinearRegression
-import joblib
+import os
+import json
+from typing import List, Optional
+import numpy as np
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 from agents.agent import Agent
+from agents.tracing import traced, in_context
+from agents.embeddings import get_embedder
 from agents.specialist_agent import SpecialistAgent
 from agents.frontier_agent import FrontierAgent
 from agents.random_forest_agent import RandomForestAgent
+from agents.knn_agent import KnnAgent
+from agents.array_forest import fingerprint
 
 class EnsembleAgent(Agent):
 
     name = "Ensemble Agent"
     color = Agent.YELLOW
+
+    # The inputs to the Linear Regression model, in the order it was trained on
+    FEATURES = ["Specialist", "Frontier", "RandomForest", "Min", "Max"]
+
+    # Seconds each member has to return its estimate, measured from the start of the fan-out
+    TIMEOUTS = {"Specialist": 60, "Frontier": 30, "RandomForest": 10}
+
+    # Cascade mode: when the kNN and Random Forest estimates agree to within this fraction,
+    # the deal is priced from them alone, without calling the Specialist or Frontier
+    CASCADE = False
+    CASCADE_TOLERANCE = 0.15
+
+    # The fitted Linear Regression model, and its weights saved as plain JSON so that sklearn isn't needed at runtime
+    MODEL_FILENAME = "ensemble_model.pkl"
+    WEIGHTS_FILENAME = "ensemble_weights.json"
     
-    def __init__(self, collection):
+    def __init__(self, collection, pricer=None):
         """
         Create an instance of Ensemble, by creating each of the models
         And loading the weights of the Ensemble
+        :param pricer: optionally, a stand-in for the remote Pricer used by the Specialist
         """
         self.log("Initializing Ensemble Agent")
-        self.specialist = SpecialistAgent()
+        self.specialist = SpecialistAgent(pricer)
         self.frontier = FrontierAgent(collection)
         self.random_forest = RandomForestAgent()
-        self.model = joblib.load('ensemble_model.pkl')
+        self.knn = KnnAgent(self.frontier)
+        self.coefficients, self.intercept = self.load_weights()
+        # Spare workers so a member that overruns its deadline doesn't hold up the next deal
+        self.executor = ThreadPoolExecutor(max_workers=4 * len(self.TIMEOUTS), thread_name_prefix="ensemble")
+        self.cascade_lock = threading.Lock()
+        self.cascade_deals = 0
+        self.cascade_saved = 0
         self.log("Ensemble Agent is ready")
 
+    def members(self) -> dict:
+        """
+        Return the member agents of this ensemble, keyed by the name of their feature
+        """
+        return {"Specialist": self.specialist, "Frontier": self.frontier, "RandomForest": self.random_forest}
+
+    def estimate_all(self, method: str, argument, known: Optional[dict] = None, keywords: Optional[dict] = None) -> dict:
+        """
+        Call the given pricing method on each of the models concurrently, each with its own deadline
+        :param method: the name of the method to call on each member, either price or price_batch
+        :param argument: the description, or list of descriptions, to pass to it
+        :param known: optionally, results already computed for some members, which aren't asked again
+        :param keywords: optionally, extra keyword arguments for the method of some members
+        :return: a dict from member name to its result, leaving out any member that failed or timed out
+        """
+        start = time.monotonic()
+        estimates = dict(known or {})
+        keywords = keywords or {}
+        futures = {
+            name: self.executor.submit(in_context(getattr(agent, method)), argument, **keywords.get(name, {}))
+            for name, agent in self.members().items() if name not in estimates
+        }
+        for name, future in futures.items():
+            remaining = max(0, self.TIMEOUTS[name] - (time.monotonic() - start))
+            try:
+                estimates[name] = future.result(timeout=remaining)
+            except TimeoutError:
+                future.cancel()
+                self.log(f"Ensemble Agent gave up waiting for {name} after {self.TIMEOUTS[name]}s")
+            except Exception as e:
+                self.log(f"Ensemble Agent found {name} failed: {e}")
+        return estimates
+
+    def fill_missing(self, estimates: dict) -> dict:
+        """
+        Fallback policy for members that didn't return: stand in the average of the others,
+        so the Min and Max features are computed from the estimates we do have
+        """
+        if not estimates:
+            raise RuntimeError("No member of the ensemble returned an estimate")
+        fallback = sum(estimates.values()) / len(estimates)
+        return {name: estimates.get(name, fallback) for name in self.TIMEOUTS}
+
+    @classmethod
+    def extract_weights(cls, model):
+        """
+        Pull the coefficients and intercept out of the fitted LinearRegression model, ordered to match FEATURES,
+        so that predictions are a plain NumPy dot product rather than a DataFrame and a predict call
+        """
+        coefficients = np.asarray(model.coef_, dtype=np.float64).ravel()
+        names = list(getattr(model, "feature_names_in_", cls.FEATURES))
+        coefficients = np.array([coefficients[names.index(name)] for name in cls.FEATURES])
+        return coefficients, float(np.ravel(model.intercept_)[0])
+
+    @classmethod
+    def load_weights(cls):
+        """
+        Load the coefficients and intercept from WEIGHTS_FILENAME
+        They are extracted from the pickled model and saved the first time, and again whenever the pickle
+        no longer matches the fingerprint saved with them; only that step imports sklearn
+        """
+        weights = None
+        if os.path.exists(cls.WEIGHTS_FILENAME):
+            with open(cls.WEIGHTS_FILENAME) as file:
+                weights = json.load(file)
+        source = fingerprint(cls.MODEL_FILENAME) if os.path.exists(cls.MODEL_FILENAME) else None
+        if weights is None or (source and weights.get("source") != source):
+            import joblib
+            coefficients, intercept = cls.extract_weights(joblib.load(cls.MODEL_FILENAME))
+            weights = {"coefficients": dict(zip(cls.FEATURES, coefficients.tolist())), "intercept": intercept, "source": source}
+            with open(cls.WEIGHTS_FILENAME, "w") as file:
+                json.dump(weights, file, indent=2)
+        return np.array([weights["coefficients"][name] for name in cls.FEATURES]), float(weights["intercept"])
+
+    def features(self, rows: List[dict]) -> np.ndarray:
+        """
+        Build the input to the Linear Regression model, one row per product, with columns in FEATURES order
+        :param rows: for each product, a dict from member name to its estimate
+        """
+        return np.array([
+            [row["Specialist"], row["Frontier"], row["RandomForest"], min(row.values()), max(row.values())]
+            for row in rows
+        ], dtype=np.float64)
+
+    def combine(self, X: np.ndarray) -> np.ndarray:
+        """
+        Apply the Linear Regression weights to a matrix of features, one row per product
+        """
+        return X @ self.coefficients + self.intercept
+
+    def log_embedding_stats(self) -> None:
+        """
+        Log the hit and miss counters of the shared embedding cache
+        """
+        stats = get_embedder().stats()
+        self.log(f"Ensemble Agent embedding cache has {stats['hits']} hits and {stats['misses']} misses")
+
+    @classmethod
+    def confident(cls, knn: float, random_forest: float) -> Optional[float]:
+        """
+        Return the average of the kNN and Random Forest estimates if they agree to within CASCADE_TOLERANCE,
+        or None if the deal needs the full ensemble
+        """
+        if knn <= 0 or random_forest <= 0:
+            return None
+        if abs(knn - random_forest) > cls.CASCADE_TOLERANCE * max(knn, random_forest):
+            return None
+        return (knn + random_forest) / 2
+
+    @traced
+    def cascade(self, descriptions: List[str]) -> List[float]:
+        """
+        Price each product from the cheap kNN and Random Forest estimates where they agree,
+        and send only the rest to the full ensemble, reusing the neighbours and Random Forest estimates found here
+        :param descriptions: the descriptions of the products
+        :return: an estimate for each product, in the same order
+        """
+        documents, prices = self.frontier.find_similars_many(descriptions)
+        knns = self.knn.price_batch(descriptions, (documents, prices))
+        random_forests = self.random_forest.price_batch(descriptions)
+        results = [self.confident(knn, rf) for knn, rf in zip(knns, random_forests)]
+        remaining = [i for i, result in enumerate(results) if result is None]
+        if remaining:
+            similars = ([documents[i] for i in remaining], [prices[i] for i in remaining])
+            known = {"RandomForest": [random_forests[i] for i in remaining]}
+            for i, y in zip(remaining, self.price_all([descriptions[i] for i in remaining], similars, known)):
+                results[i] = y
+        self.trace(deals=len(descriptions), skipped=len(descriptions) - len(remaining))
+        with self.cascade_lock:
+            self.cascade_deals += len(descriptions)
+            self.cascade_saved += len(descriptions) - len(remaining)
+            saved = self.cascade_saved / self.cascade_deals
+        self.log(f"Ensemble Agent cascade priced {len(descriptions) - len(remaining)} of {len(descriptions)} from kNN and Random Forest alone, "
+                 f"skipping the Specialist and Frontier for {saved:.0%} of deals so far")
+        return results
+
+    @traced
     def price(self, description: str) -> float:
         """
         Run this ensemble model
-        Ask each of the models to price the product
+        Ask each of the models to price the product, concurrently and each with a deadline
         Then use the Linear Regression model to return the weighted price
+        In cascade mode, the product may be priced from the kNN and Random Forest estimates alone
         :param description: the description of a product
         :return: an estimate of its price
         """
+        if self.CASCADE:
+            return self.cascade([description])[0]
         self.log("Running Ensemble Agent - collaborating with specialist, frontier and random forest agents")
-        specialist = self.specialist.price(description)
-        frontier = self.frontier.price(description)
-        random_forest = self.random_forest.price(description)
-        X = pd.DataFrame({
-            'Specialist': [specialist],
-            'Frontier': [frontier],
-            'RandomForest': [random_forest],
-            'Min': [min(specialist, frontier, random_forest)],
-            'Max': [max(specialist, frontier, random_forest)],
-        })
-        y = self.model.predict(X)[0]
+        estimates = self.fill_missing(self.estimate_all("price", description))
+        y = float(self.combine(self.features([estimates]))[0])
         self.log(f"Ensemble Agent complete - returning ${y:.2f}")
-        return y
\ No newline at end of file
+        self.log_embedding_stats()
+        return y
+
+    @traced
+    def price_batch(self, descriptions: List[str]) -> List[float]:
+        """
+        Run this ensemble model over several products at once, through the cascade in cascade mode
+        :param descriptions: the descriptions of the products
+        :return: an estimate for each product, in the same order
+        """
+        if not descriptions:
+            return []
+        if self.CASCADE:
+            return self.cascade(descriptions)
+        return self.price_all(descriptions)
+
+    @traced
+    def price_all(self, descriptions: List[str], similars: Optional[tuple] = None, known: Optional[dict] = None) -> List[float]:
+        """
+        Each member prices the whole batch in one go, and the Linear Regression model predicts all rows together
+        :param similars: optionally, the documents and prices already found by the Frontier's RAG search for these descriptions
+        :param known: optionally, estimates already made by some members, keyed by member name
+        """
+        self.log(f"Running Ensemble Agent on a batch of {len(descriptions)} - collaborating with specialist, frontier and random forest agents")
+        self.trace(deals=len(descriptions))
+        keywords = {"Frontier": {"similars": similars}} if similars else None
+        batches = self.estimate_all("price_batch", descriptions, known, keywords)
+        rows = [self.fill_missing({name: batch[i] for name, batch in batches.items()}) for i in range(len(descriptions))]
+        ys = [float(y) for y in self.combine(self.features(rows))]
+        self.log(f"Ensemble Agent complete - returning {', '.join(f'${y:.2f}' for y in ys)}")
+        self.log_embedding_stats()
+        return ys
@@ -4,14 +4,15 @@ import os
 import re
 import math
 import json
-from typing import List, Dict
+import time
+from typing import List, Dict, Optional
+from concurrent.futures import ThreadPoolExecutor
 from openai import OpenAI
-from sentence_transformers import SentenceTransformer
-from datasets import load_dataset
-import chromadb
-from items import Item
-from testing import Tester
 from agents.agent import Agent
+from agents.tracing import traced, in_context
+from agents.embeddings import get_embedder
+from agents.response_cache import ResponseCache
+from agents.vector_snapshot import VectorSnapshot
 
 
 class FrontierAgent(Agent):
@@ -20,16 +21,32 @@ class FrontierAgent(Agent):
     color = Agent.BLUE
 
     MODEL = "gpt-4o-mini"
+
+    # IVF lists of the snapshot to scan per RAG search, or None for an exact search, which matches Chroma
+    # Recall@5 of IVF hasn't been measured on the products collection, only on synthetic clustered vectors (1.0 at nprobe 8);
+    # set this only after benchmark_snapshot.py --nprobe reports the recall for the exported snapshot
+    SNAPSHOT_NPROBE = None
     
     def __init__(self, collection):
         """
         Set up this instance by connecting to OpenAI, to the Chroma Datastore,
         And setting up the vector encoding model
+        If the collection has been exported with benchmark_snapshot.py, the snapshot is queried in-process instead,
+        unless the collection has changed since
         """
         self.log("Initializing Frontier Agent")
         self.openai = OpenAI()
         self.collection = collection
-        self.model = SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2')
+        self.model = get_embedder()
+        self.cache = ResponseCache()
+        self.snapshot = None
+        if VectorSnapshot.exists():
+            snapshot = VectorSnapshot()
+            if snapshot.matches(collection):
+                self.snapshot = snapshot
+                self.log(f"Frontier Agent has memory mapped a snapshot of {len(snapshot):,} products")
+            else:
+                self.log(f"Frontier Agent is ignoring a snapshot of {snapshot.count:,} products as the collection has changed")
         self.log("Frontier Agent is ready")
 
     def make_context(self, similars: List[str], prices: List[float]) -> str:
@@ -67,11 +84,30 @@ class FrontierAgent(Agent):
         """
         Return a list of items similar to the given one by looking in the Chroma datastore
         """
-        self.log("Frontier Agent is performing a RAG search of the Chroma datastore to find 5 similar products")
-        vector = self.model.encode([description])
-        results = self.collection.query(query_embeddings=vector.astype(float).tolist(), n_results=5)
-        documents = results['documents'][0][:]
-        prices = [m['price'] for m in results['metadatas'][0][:]]
+        [documents], [prices] = self.find_similars_many([description])
+        return documents, prices
+
+    @traced
+    def find_similars_many(self, descriptions: List[str], n_results: int = 5):
+        """
+        Return the items similar to each of the given ones, with one encoding pass and a single
+        multi-embedding query of the snapshot if there is one, or else the Chroma datastore
+        :param descriptions: descriptions of the products
+        :param n_results: how many similar products to find for each
+        :return: a list of documents and a list of prices for each product, in the same order
+        """
+        store = "snapshot" if self.snapshot else "Chroma datastore"
+        self.log(f"Frontier Agent is performing a RAG search of the {store} to find {n_results} similar products for {len(descriptions)} products")
+        self.trace(queries=len(descriptions))
+        with self.span("encode", texts=len(descriptions)):
+            vectors = self.model.encode(descriptions)
+        with self.span("vector_search", store=store, n_results=n_results):
+            if self.snapshot:
+                documents, prices = self.snapshot.query(vectors, n_results=n_results, nprobe=self.SNAPSHOT_NPROBE)
+            else:
+                results = self.collection.query(query_embeddings=vectors.tolist(), n_results=n_results)
+                documents = results['documents']
+                prices = [[m['price'] for m in metadatas] for metadatas in results['metadatas']]
         self.log("Frontier Agent has found similar products")
         return documents, prices
 
@@ -83,6 +119,32 @@ class FrontierAgent(Agent):
         match = re.search(r"[-+]?\d*\.\d+|\d+", s)
         return float(match.group()) if match else 0.0
 
+    @traced
+    def call_openai(self, description: str, documents: List[str], prices: List[float]) -> float:
+        """
+        Ask OpenAI for the price of this product, given the similar products as context
+        The call is deterministic, so a repeat of the same prompt is answered from the response cache
+        """
+        messages = self.messages_for(description, documents, prices)
+        reply = self.cache.get(self.MODEL, messages)
+        self.trace(cache_hits=int(reply is not None))
+        if reply is None:
+            start = time.perf_counter()
+            response = self.openai.chat.completions.create(
+                model=self.MODEL, 
+                messages=messages,
+                seed=42,
+                max_tokens=5
+            )
+            reply = response.choices[0].message.content
+            self.cache.put(self.MODEL, messages, reply, time.perf_counter() - start)
+        else:
+            self.log("Frontier Agent found this prompt in the response cache")
+        stats = self.cache.stats()
+        self.log(f"Frontier Agent response cache hit rate {stats['hit_rate']:.0%}, saving about {stats['saved_seconds']:.1f}s so far")
+        return self.get_price(reply)
+
+    @traced
     def price(self, description: str) -> float:
         """
         Make a call to OpenAI to estimate the price of the described product,
@@ -92,14 +154,22 @@ class FrontierAgent(Agent):
         """
         documents, prices = self.find_similars(description)
         self.log("Frontier Agent is about to call OpenAI with context including 5 similar products")
-        response = self.openai.chat.completions.create(
-            model=self.MODEL, 
-            messages=self.messages_for(description, documents, prices),
-            seed=42,
-            max_tokens=5
-        )
-        reply = response.choices[0].message.content
-        result = self.get_price(reply)
+        result = self.call_openai(description, documents, prices)
         self.log(f"Frontier Agent completed - predicting ${result:.2f}")
         return result
-        
\ No newline at end of file
+
+    @traced
+    def price_batch(self, descriptions: List[str], similars: Optional[tuple] = None) -> List[float]:
+        """
+        Estimate several products at once: one encoding pass, one multi-query RAG search,
+        then the OpenAI calls made concurrently
+        :param descriptions: descriptions of the products
+        :param similars: optionally, the documents and prices already found by find_similars_many for these descriptions
+        :return: an estimate of each price, in the same order
+        """
+        documents, prices = similars or self.find_similars_many(descriptions)
+        self.log(f"Frontier Agent is about to call OpenAI {len(descriptions)} times with context including 5 similar products")
+        with ThreadPoolExecutor(max_workers=max(1, len(descriptions))) as executor:
+            results = list(executor.map(in_context(self.call_openai), descriptions, documents, prices))
+        self.log(f"Frontier Agent completed - predicting {', '.join(f'${r:.2f}' for r in results)}")
+        return results
@@ -0,0 +1,136 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from typing import Optional
+import requests
+
+CACHE_DIR = "http_cache"
+MAX_AGE = 7 * 24 * 60 * 60
+MAX_BYTES = 200 * 1024 * 1024
+TIMEOUT = 20
+
+
+class HttpCache:
+    """
+    An on-disk cache of HTTP responses that revalidates with conditional GETs
+    Each URL is stored as a body file plus a small JSON file with its ETag and Last-Modified validators
+    A 304 Not Modified from the server is served from disk
+    """
+
+    def __init__(self, directory: str = CACHE_DIR, max_age: float = MAX_AGE, max_bytes: int = MAX_BYTES):
+        """
+        :param directory: the folder to keep cached responses in
+        :param max_age: entries not used for this many seconds are evicted
+        :param max_bytes: the total size of cached bodies is kept under this limit
+        """
+        self.directory = directory
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def paths(self, url: str):
+        """
+        Return the body and metadata filenames for this url
+        """
+        key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        base = os.path.join(self.directory, key)
+        return base + ".body", base + ".json"
+
+    def read_meta(self, meta_path: str) -> Optional[dict]:
+        try:
+            with open(meta_path, "r") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def write(self, url: str, response: requests.Response) -> None:
+        """
+        Store this response and its validators, writing to temporary files first so readers never see a partial entry
+        """
+        body_path, meta_path = self.paths(url)
+        meta = {
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "used": time.time(),
+            "size": len(response.content),
+        }
+        suffix = f".{threading.get_ident()}.tmp"
+        with open(body_path + suffix, "wb") as file:
+            file.write(response.content)
+        with open(meta_path + suffix, "w") as file:
+            json.dump(meta, file)
+        os.replace(body_path + suffix, body_path)
+        os.replace(meta_path + suffix, meta_path)
+
+    def get(self, url: str, session: Optional[requests.Session] = None, timeout: float = TIMEOUT) -> bytes:
+        """
+        Return the body for this url, sending the cached validators so the server can reply 304
+        :param url: the url to fetch
+        :param session: an optional Session to reuse keep-alive connections
+        :param timeout: the request timeout in seconds
+        :return: the response body, from the network or from disk
+        """
+        body_path, meta_path = self.paths(url)
+        meta = self.read_meta(meta_path)
+        headers = {}
+        if meta and os.path.exists(body_path):
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+        response = (session or requests).get(url, headers=headers, timeout=timeout)
+        if response.status_code == 304 and headers:
+            try:
+                with open(body_path, "rb") as file:
+                    content = file.read()
+                meta["used"] = time.time()
+                with open(meta_path, "w") as file:
+                    json.dump(meta, file)
+                with self.lock:
+                    self.hits += 1
+                return content
+            except OSError:
+                response = (session or requests).get(url, timeout=timeout)
+        with self.lock:
+            self.misses += 1
+        if response.ok:
+            self.write(url, response)
+        return response.content
+
+    def evict(self) -> int:
+        """
+        Remove entries that have not been used within max_age, then the least recently used
+        until the cache is under max_bytes
+        :return: the number of entries removed
+        """
+        with self.lock:
+            entries = []
+            for name in os.listdir(self.directory):
+                if name.endswith(".json"):
+                    meta_path = os.path.join(self.directory, name)
+                    meta = self.read_meta(meta_path) or {"used": 0, "size": 0}
+                    entries.append((meta.get("used", 0), meta.get("size", 0), meta_path))
+            entries.sort()
+            cutoff = time.time() - self.max_age
+            total = sum(size for _, size, _ in entries)
+            removed = 0
+            for used, size, meta_path in entries:
+                if used >= cutoff and total <= self.max_bytes:
+                    break
+                for path in (meta_path, meta_path[:-len(".json")] + ".body"):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                total -= size
+                removed += 1
+        if removed:
+            logging.info(f"HTTP cache evicted {removed} entries")
+        return removed
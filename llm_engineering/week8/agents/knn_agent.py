@@ -0,0 +1,46 @@
+from typing import List, Optional
+import numpy as np
+from agents.agent import Agent
+from agents.tracing import traced
+from agents.frontier_agent import FrontierAgent
+
+
+class KnnAgent(Agent):
+    """
+    A cheap price estimate from the nearest products that the Frontier Agent retrieves for its prompt,
+    with no call to an LLM
+    """
+
+    name = "KNN Agent"
+    color = Agent.BLUE
+
+    NEIGHBOURS = 5
+
+    def __init__(self, frontier: FrontierAgent):
+        """
+        Share the Frontier Agent's vector encoding model and RAG search
+        """
+        self.frontier = frontier
+
+    @staticmethod
+    def estimate(prices: List[float]) -> float:
+        """
+        The median of the neighbours' prices, so that one mismatched neighbour doesn't skew it
+        """
+        return float(np.median(prices)) if prices else 0.0
+
+    def price(self, description: str) -> float:
+        return self.price_batch([description])[0]
+
+    @traced
+    def price_batch(self, descriptions: List[str], similars: Optional[tuple] = None) -> List[float]:
+        """
+        Estimate several products at once from one multi-query RAG search
+        :param descriptions: descriptions of the products
+        :param similars: optionally, the documents and prices already found by find_similars_many for these descriptions
+        :return: the median price of the nearest products to each, in the same order
+        """
+        _, prices = similars or self.frontier.find_similars_many(descriptions, n_results=self.NEIGHBOURS)
+        results = [self.estimate(neighbours[:self.NEIGHBOURS]) for neighbours in prices]
+        self.log(f"KNN Agent completed - predicting {', '.join(f'${r:.2f}' for r in results)}")
+        return results
@@ -0,0 +1,184 @@
+import os
+import json
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from typing import Iterator, List
+from agents.deals import Opportunity, SeenIndex
+
+PAGE_SIZE = 500
+# Each line of a JsonlMemoryStore starts with the deal URL, so it can be read without parsing the Opportunity
+URL_PREFIX = b'{"url": '
+
+
+class MemoryStore(ABC):
+    """
+    An abstract superclass for the stores that remember the Opportunities surfaced so far
+    Behaves like a read-only list that can be appended to; each append writes only the new Opportunity
+    The urls attribute supports `url in store.urls` without loading any Opportunities
+    """
+
+    urls = None
+
+    @abstractmethod
+    def __len__(self) -> int:
+        pass
+
+    @abstractmethod
+    def page(self, offset: int, limit: int = PAGE_SIZE) -> List[Opportunity]:
+        """
+        Return up to limit Opportunities starting at offset, in the order they were added
+        """
+        pass
+
+    @abstractmethod
+    def append(self, opportunity: Opportunity) -> None:
+        pass
+
+    def __getitem__(self, index: int) -> Opportunity:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("memory index out of range")
+        return self.page(index, 1)[0]
+
+    def __iter__(self) -> Iterator[Opportunity]:
+        offset = 0
+        while True:
+            opportunities = self.page(offset)
+            yield from opportunities
+            if len(opportunities) < PAGE_SIZE:
+                break
+            offset += PAGE_SIZE
+
+    def import_json(self, filename: str) -> int:
+        """
+        Copy the Opportunities from a legacy memory.json file into this store, if it's empty
+        :return: the number of Opportunities imported
+        """
+        if len(self) or not os.path.exists(filename):
+            return 0
+        with open(filename, "r") as file:
+            data = json.load(file)
+        for item in data:
+            self.append(Opportunity(**item))
+        return len(data)
+
+
+class JsonlMemoryStore(MemoryStore):
+    """
+    A MemoryStore kept as an append-only JSON Lines file, one {"url": ..., "opportunity": ...} object per line
+    Only the byte offset and URL of each line are indexed at startup; Opportunities are parsed when read
+    """
+
+    decoder = json.JSONDecoder()
+
+    def __init__(self, filename: str = "memory.jsonl"):
+        self.filename = filename
+        self.offsets = []
+        self.urls = SeenIndex()
+        self.lock = threading.Lock()
+        if os.path.exists(filename):
+            with open(filename, "rb") as file:
+                offset = 0
+                for line in file:
+                    if line.strip():
+                        self.offsets.append(offset)
+                        self.urls.update([self.url_of(line)])
+                    offset += len(line)
+
+    @classmethod
+    def url_of(cls, line: bytes) -> str:
+        """
+        Decode just the URL at the start of a line; lines written before the URL was stored there are parsed in full
+        """
+        if line.startswith(URL_PREFIX):
+            return cls.decoder.raw_decode(line[len(URL_PREFIX):].decode("utf-8"))[0]
+        return json.loads(line)["deal"]["url"]
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def page(self, offset: int, limit: int = PAGE_SIZE) -> List[Opportunity]:
+        with self.lock:
+            offsets = self.offsets[offset:offset + limit]
+        result = []
+        if offsets:
+            with open(self.filename, "rb") as file:
+                for position in offsets:
+                    file.seek(position)
+                    data = json.loads(file.readline())
+                    result.append(Opportunity(**data.get("opportunity", data)))
+        return result
+
+    def append(self, opportunity: Opportunity) -> None:
+        record = {"url": opportunity.deal.url, "opportunity": opportunity.dict()}
+        line = (json.dumps(record) + "\n").encode("utf-8")
+        with self.lock:
+            with open(self.filename, "ab") as file:
+                file.seek(0, os.SEEK_END)
+                self.offsets.append(file.tell())
+                file.write(line)
+            self.urls.update([opportunity.deal.url])
+
+
+class SqliteUrls:
+    """
+    A view of the URLs in a SqliteMemoryStore that answers membership with an indexed query
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def __contains__(self, url: str) -> bool:
+        with self.store.lock:
+            row = self.store.db.execute("SELECT 1 FROM opportunities WHERE url = ? LIMIT 1", (url,)).fetchone()
+        return row is not None
+
+
+class SqliteMemoryStore(MemoryStore):
+    """
+    A MemoryStore kept in a SQLite database, with an index on the deal URL
+    Nothing is loaded at startup; Opportunities are read a page at a time
+    """
+
+    def __init__(self, filename: str = "memory.db"):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS opportunities (id INTEGER PRIMARY KEY, url TEXT, data TEXT)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS opportunities_url ON opportunities (url)")
+        self.db.commit()
+        self.urls = SqliteUrls(self)
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM opportunities").fetchone()[0]
+
+    def page(self, offset: int, limit: int = PAGE_SIZE) -> List[Opportunity]:
+        with self.lock:
+            rows = self.db.execute("SELECT data FROM opportunities ORDER BY id LIMIT ? OFFSET ?", (limit, offset)).fetchall()
+        return [Opportunity(**json.loads(data)) for data, in rows]
+
+    def append(self, opportunity: Opportunity) -> None:
+        with self.lock:
+            self.db.execute(
+                "INSERT INTO opportunities (url, data) VALUES (?, ?)",
+                (opportunity.deal.url, json.dumps(opportunity.dict())),
+            )
+            self.db.commit()
+
+
+BACKENDS = {"jsonl": (JsonlMemoryStore, "memory.jsonl"), "sqlite": (SqliteMemoryStore, "memory.db")}
+
+
+def open_memory(backend: str = "sqlite", legacy_filename: str = "memory.json") -> MemoryStore:
+    """
+    Open the memory store for this backend, importing the legacy JSON file the first time
+    :param backend: either jsonl or sqlite
+    :param legacy_filename: the memory.json file written by earlier versions
+    """
+    store_class, filename = BACKENDS[backend]
+    store = store_class(filename)
+    store.import_json(legacy_filename)
+    return store
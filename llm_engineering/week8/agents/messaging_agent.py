@@ -1,15 +1,25 @@
 import os
 # from twilio.rest import Client
 from agents.deals import Opportunity
+import time
 import http.client
 import urllib
+from urllib.parse import urlsplit
+from typing import Iterator, List, Tuple
 from agents.agent import Agent
+from agents.tracing import traced
+from agents.outbox import Outbox, PermanentFailure
 
 # Uncomment the Twilio lines if you wish to use Twilio
 
 DO_TEXT = False
 DO_PUSH = True
 
+# Point this at a local stub to measure delivery without calling Pushover
+PUSHOVER_URL = os.getenv('PUSHOVER_URL', 'https://api.pushover.net:443')
+# Pushover messages are limited to 1024 characters; queued alerts are batched into one message up to this size
+MAX_MESSAGE_LENGTH = 1024
+
 class MessagingAgent(Agent):
 
     name = "Messaging Agent"
@@ -32,6 +42,8 @@ class MessagingAgent(Agent):
         if DO_PUSH:
             self.pushover_user = os.getenv('PUSHOVER_USER', 'your-pushover-user-if-not-using-env')
             self.pushover_token = os.getenv('PUSHOVER_TOKEN', 'your-pushover-user-if-not-using-env')
+            self.connection = None
+            self.outbox = Outbox(self.deliver)
             self.log("Messaging Agent has initialized Pushover")
 
     def message(self, text):
@@ -47,19 +59,70 @@ class MessagingAgent(Agent):
 
     def push(self, text):
         """
-        Send a Push Notification using the Pushover API
+        Queue a Push Notification to be sent with the Pushover API by the outbox's background worker
+        This returns immediately; delivery is retried with backoff if it fails
+        """
+        self.log("Messaging Agent is queueing a push notification")
+        self.outbox.put(text)
+
+    def get_connection(self) -> http.client.HTTPConnection:
+        """
+        Return the keep-alive connection to Pushover, opening it if needed
+        """
+        if self.connection is None:
+            url = urlsplit(PUSHOVER_URL)
+            connection_class = http.client.HTTPSConnection if url.scheme == "https" else http.client.HTTPConnection
+            self.connection = connection_class(url.netloc, timeout=10)
+        return self.connection
+
+    def batches(self, texts: List[str]) -> List[Tuple[str, List[int]]]:
+        """
+        Join queued alerts into as few messages as fit within Pushover's length limit
+        :return: each message, with the positions of the alerts it carries
+        """
+        batches = []
+        for i, text in enumerate(texts):
+            if batches and len(batches[-1][0]) + 2 + len(text) <= MAX_MESSAGE_LENGTH:
+                batches[-1] = (batches[-1][0] + "\n\n" + text, batches[-1][1] + [i])
+            else:
+                batches.append((text, [i]))
+        return batches
+
+    @traced
+    def deliver(self, texts: List[str]) -> Iterator[List[int]]:
+        """
+        Send these queued notifications over the reused connection; called by the outbox worker
+        Yields the positions of the alerts in each message once Pushover has accepted it,
+        so the outbox only retries the alerts that weren't delivered
+        Raises PermanentFailure if Pushover rejects the request, or another exception to have it retried
         """
-        self.log("Messaging Agent is sending a push notification")
-        conn = http.client.HTTPSConnection("api.pushover.net:443")
-        conn.request("POST", "/1/messages.json",
-          urllib.parse.urlencode({
-            "token": self.pushover_token,
-            "user": self.pushover_user,
-            "message": text,
-            "sound": "cashregister"
-          }), { "Content-type": "application/x-www-form-urlencoded" })
-        conn.getresponse()
+        self.trace(messages=len(texts))
+        for message, positions in self.batches(texts):
+            start = time.perf_counter()
+            try:
+                conn = self.get_connection()
+                conn.request("POST", "/1/messages.json",
+                  urllib.parse.urlencode({
+                    "token": self.pushover_token,
+                    "user": self.pushover_user,
+                    "message": message,
+                    "sound": "cashregister"
+                  }), { "Content-type": "application/x-www-form-urlencoded" })
+                response = conn.getresponse()
+                response.read()
+            except Exception:
+                if self.connection:
+                    self.connection.close()
+                self.connection = None
+                raise
+            if response.status == 429 or response.status >= 500:
+                raise IOError(f"Pushover returned {response.status}")
+            if response.status >= 400:
+                raise PermanentFailure(f"Pushover rejected the notification with {response.status}")
+            self.log(f"Messaging Agent delivered a push notification in {time.perf_counter() - start:.2f}s")
+            yield positions
 
+    @traced
     def alert(self, opportunity: Opportunity):
         """
         Make an alert about the specified Opportunity
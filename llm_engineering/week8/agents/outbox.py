@@ -0,0 +1,172 @@
+import time
+import sqlite3
+import logging
+import threading
+from collections import deque
+from typing import Callable, Iterable, List, Optional
+
+OUTBOX_FILENAME = "outbox.db"
+MAX_ATTEMPTS = 6
+BACKOFF = 2.0
+MAX_BACKOFF = 300.0
+POLL_SECONDS = 5.0
+# Messages that were given up on are kept this long for inspection; delivered messages are deleted straight away
+FAILED_RETENTION = 7 * 24 * 60 * 60
+
+
+class PermanentFailure(Exception):
+    """
+    Raised by a deliver function when retrying would not help, such as a rejected request
+    """
+
+
+class Outbox:
+    """
+    A persistent queue of messages, delivered by a background worker
+    Messages survive restarts in SQLite; failed deliveries are retried with exponential backoff
+    The worker hands every pending message to the deliver function at once, so it can batch them,
+    and it reports back which messages have gone out, so only the rest are retried
+    """
+
+    def __init__(self, deliver: Callable[[List[str]], Iterable[List[int]]], filename: str = OUTBOX_FILENAME,
+                 max_attempts: int = MAX_ATTEMPTS, backoff: float = BACKOFF):
+        """
+        :param deliver: sends a list of messages, yielding the positions in the list of the messages
+        as each send succeeds, and raising an exception for those that couldn't be delivered
+        :param filename: the SQLite database holding the queue
+        :param max_attempts: messages are given up on after this many failed deliveries
+        :param backoff: the delay before the first retry, doubling on each further attempt
+        """
+        self.deliver = deliver
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.idle = threading.Event()
+        self.stopping = threading.Event()
+        self.delivered = 0
+        self.failed = 0
+        self.retries = 0
+        self.latencies = deque(maxlen=1000)
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS outbox (id INTEGER PRIMARY KEY, text TEXT, created REAL,
+                           attempts INTEGER DEFAULT 0, next_attempt REAL, status TEXT DEFAULT 'pending')""")
+        self.db.execute("DELETE FROM outbox WHERE status = 'delivered' OR (status = 'failed' AND created < ?)",
+                        (time.time() - FAILED_RETENTION,))
+        self.db.commit()
+        self.worker = threading.Thread(target=self.loop, name="outbox", daemon=True)
+        self.worker.start()
+
+    def put(self, text: str) -> None:
+        """
+        Queue a message for delivery and return immediately
+        """
+        now = time.time()
+        with self.lock:
+            self.db.execute("INSERT INTO outbox (text, created, next_attempt) VALUES (?, ?, ?)", (text, now, now))
+            self.db.commit()
+            self.idle.clear()
+        self.wake.set()
+
+    def due(self) -> list:
+        with self.lock:
+            return self.db.execute(
+                "SELECT id, text, created, attempts FROM outbox WHERE status = 'pending' AND next_attempt <= ? ORDER BY id",
+                (time.time(),),
+            ).fetchall()
+
+    def next_due(self) -> Optional[float]:
+        """
+        Return when the next pending message is due, or None and mark the outbox idle if there are none
+        """
+        with self.lock:
+            row = self.db.execute("SELECT MIN(next_attempt) FROM outbox WHERE status = 'pending'").fetchone()
+            if row[0] is None:
+                self.idle.set()
+        return row[0]
+
+    def delivered_rows(self, rows: list) -> None:
+        """
+        Delete these delivered messages from the queue and record their latency
+        """
+        if not rows:
+            return
+        now = time.time()
+        ids = [row[0] for row in rows]
+        with self.lock:
+            self.db.execute(f"DELETE FROM outbox WHERE id IN ({','.join('?' * len(ids))})", ids)
+            self.db.commit()
+            self.delivered += len(rows)
+            self.latencies.extend(now - row[2] for row in rows)
+
+    def send(self, rows: list) -> None:
+        """
+        Deliver these messages together, recording the outcome for each of them as soon as it is known,
+        so that messages already delivered are never sent again when a later one fails
+        """
+        sent = set()
+        try:
+            for positions in self.deliver([row[1] for row in rows]):
+                self.delivered_rows([rows[i] for i in positions if i not in sent])
+                sent.update(positions)
+        except Exception as e:
+            permanent = isinstance(e, PermanentFailure)
+            remaining = [row for i, row in enumerate(rows) if i not in sent]
+            with self.lock:
+                for id, _, _, attempts in remaining:
+                    attempts += 1
+                    if permanent or attempts >= self.max_attempts:
+                        self.db.execute("UPDATE outbox SET status = 'failed', attempts = ? WHERE id = ?", (attempts, id))
+                        self.failed += 1
+                    else:
+                        delay = min(MAX_BACKOFF, self.backoff * 2 ** (attempts - 1))
+                        self.db.execute("UPDATE outbox SET attempts = ?, next_attempt = ? WHERE id = ?",
+                                        (attempts, time.time() + delay, id))
+                        self.retries += 1
+                self.db.commit()
+            logging.warning(f"Outbox failed to deliver {len(remaining)} of {len(rows)} messages: {e}")
+            return
+        # A deliver function that returns without raising has delivered everything, even if it didn't say so
+        self.delivered_rows([row for i, row in enumerate(rows) if i not in sent])
+
+    def loop(self) -> None:
+        while not self.stopping.is_set():
+            rows = self.due()
+            if rows:
+                self.send(rows)
+                continue
+            next_due = self.next_due()
+            if next_due is None:
+                timeout = POLL_SECONDS
+            else:
+                timeout = max(0.0, min(POLL_SECONDS, next_due - time.time()))
+            self.wake.wait(timeout)
+            self.wake.clear()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until nothing is left pending
+        :return: True if the outbox emptied within the timeout
+        """
+        return self.idle.wait(timeout)
+
+    def close(self) -> None:
+        self.stopping.set()
+        self.wake.set()
+        self.worker.join()
+
+    def stats(self) -> dict:
+        """
+        Return the delivery counts and latencies, measured from when each message was queued
+        """
+        with self.lock:
+            pending = self.db.execute("SELECT COUNT(*) FROM outbox WHERE status = 'pending'").fetchone()[0]
+            latencies = sorted(self.latencies)
+        return {
+            "pending": pending,
+            "delivered": self.delivered,
+            "failed": self.failed,
+            "retries": self.retries,
+            "average_latency": sum(latencies) / len(latencies) if latencies else 0.0,
+            "max_latency": latencies[-1] if latencies else 0.0,
+        }
@@ -0,0 +1,148 @@
+import time
+import queue
+import logging
+import threading
+from typing import Callable, Iterable, List, Optional
+
+# Marks the end of the stream of items flowing through a pipeline
+DONE = object()
+
+QUEUE_SIZE = 10
+
+
+class Stage:
+    """
+    A stage in a streaming pipeline, running in its own thread(s)
+    It takes items from its inbox in batches, calls its work function on each batch,
+    and puts every result into its outbox, keeping counts and timings as it goes
+    """
+
+    def __init__(self, name: str, work: Callable[[List], Iterable], batch_size: int = 1, workers: int = 1):
+        """
+        :param name: the name of this stage, used in the metrics
+        :param work: a function from a batch of input items to an iterable of output items
+        :param batch_size: how many items to gather before calling work; a partial batch is flushed at the end
+        :param workers: how many threads run this stage concurrently
+        """
+        self.name = name
+        self.work = work
+        self.batch_size = batch_size
+        self.workers = workers
+        self.items_in = 0
+        self.items_out = 0
+        self.busy_seconds = 0.0
+        self.errors = 0
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.lock = threading.Lock()
+
+    def process(self, batch: List, outbox: queue.Queue) -> None:
+        start = time.perf_counter()
+        try:
+            for result in self.work(batch):
+                outbox.put(result)
+                with self.lock:
+                    self.items_out += 1
+        except Exception:
+            logging.exception(f"Pipeline stage {self.name} failed on a batch of {len(batch)}")
+            with self.lock:
+                self.errors += 1
+        with self.lock:
+            self.items_in += len(batch)
+            self.busy_seconds += time.perf_counter() - start
+
+    def loop(self, inbox: queue.Queue, outbox: queue.Queue) -> None:
+        batch = []
+        while True:
+            item = inbox.get()
+            if item is DONE:
+                inbox.put(DONE)
+                break
+            with self.lock:
+                if self.started is None:
+                    self.started = time.perf_counter()
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                self.process(batch, outbox)
+                batch = []
+        if batch:
+            self.process(batch, outbox)
+
+    def run(self, inbox: queue.Queue, outbox: queue.Queue) -> List[threading.Thread]:
+        """
+        Start this stage's threads; when they have all finished, DONE is passed on to the outbox
+        """
+        threads = [threading.Thread(target=self.loop, args=(inbox, outbox), name=f"{self.name}-{i}", daemon=True)
+                   for i in range(self.workers)]
+        for thread in threads:
+            thread.start()
+
+        def finish():
+            for thread in threads:
+                thread.join()
+            self.finished = time.perf_counter()
+            outbox.put(DONE)
+
+        closer = threading.Thread(target=finish, name=f"{self.name}-done", daemon=True)
+        closer.start()
+        return threads + [closer]
+
+    def metrics(self) -> dict:
+        """
+        Return the items processed, time spent working, and throughput of this stage
+        """
+        elapsed = (self.finished or time.perf_counter()) - (self.started or time.perf_counter())
+        return {
+            "stage": self.name,
+            "items_in": self.items_in,
+            "items_out": self.items_out,
+            "errors": self.errors,
+            "busy_seconds": self.busy_seconds,
+            "elapsed_seconds": elapsed,
+            "items_per_second": self.items_in / self.busy_seconds if self.busy_seconds else 0.0,
+        }
+
+
+class Pipeline:
+    """
+    A chain of Stages joined by bounded queues, so that each stage works on early items
+    while the stage before it is still producing later ones
+    """
+
+    def __init__(self, stages: List[Stage], queue_size: int = QUEUE_SIZE):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.source_seconds = 0.0
+        self.total_seconds = 0.0
+
+    def run(self, source: Iterable) -> List:
+        """
+        Feed the items from source through every stage, and return the outputs of the last stage
+        """
+        start = time.perf_counter()
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages))] + [queue.Queue()]
+        for stage, inbox, outbox in zip(self.stages, queues, queues[1:]):
+            stage.run(inbox, outbox)
+        try:
+            for item in source:
+                queues[0].put(item)
+        finally:
+            self.source_seconds = time.perf_counter() - start
+            queues[0].put(DONE)
+        results = []
+        while (item := queues[-1].get()) is not DONE:
+            results.append(item)
+        self.total_seconds = time.perf_counter() - start
+        return results
+
+    def metrics(self) -> List[dict]:
+        return [stage.metrics() for stage in self.stages]
+
+    def log_metrics(self, log: Callable[[str], None]) -> None:
+        """
+        Report the throughput of each stage with the given log function
+        """
+        log(f"Pipeline source produced its items in {self.source_seconds:.1f}s; end to end took {self.total_seconds:.1f}s")
+        for m in self.metrics():
+            log(f"Pipeline stage {m['stage']}: {m['items_in']} in, {m['items_out']} out, {m['errors']} errors, "
+                f"busy {m['busy_seconds']:.1f}s of {m['elapsed_seconds']:.1f}s, {m['items_per_second']:.2f} items/s")
@@ -1,9 +1,16 @@
+import time
+import threading
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, List
+import psutil
 from agents.agent import Agent
 from agents.deals import ScrapedDeal, DealSelection, Deal, Opportunity
 from agents.scanner_agent import ScannerAgent
 from agents.ensemble_agent import EnsembleAgent
 from agents.messaging_agent import MessagingAgent
+from agents.pipeline import Pipeline, Stage
+from agents.tracing import traced, in_context
 
 
 class PlanningAgent(Agent):
@@ -12,16 +19,87 @@ class PlanningAgent(Agent):
     color = Agent.GREEN
     DEAL_THRESHOLD = 50
 
+    # Settings for plan_pipelined and plan_streaming: scraped deals per scanner call, deals kept from each call, and concurrent pricing
+    CHUNK_SIZE = 10
+    DEALS_PER_CHUNK = 2
+    PRICING_WORKERS = 2
+
+    # The Agents this planner coordinates across, in the order they are needed
+    AGENTS = ["scanner", "ensemble", "messenger"]
+
     def __init__(self, collection):
         """
-        Create instances of the 3 Agents that this planner coordinates across
+        Set up this planner; the 3 Agents it coordinates across are created when first needed
         """
         self.log("Planning Agent is initializing")
-        self.scanner = ScannerAgent()
-        self.ensemble = EnsembleAgent(collection)
-        self.messenger = MessagingAgent()
+        self.collection = collection
+        self.agents = {}
+        self.locks = {name: threading.Lock() for name in self.AGENTS}
+        self.startup_report = {}
+        self.warm_thread = None
         self.log("Planning Agent is ready")
 
+    def create(self, name: str) -> Agent:
+        if name == "scanner":
+            return ScannerAgent()
+        if name == "ensemble":
+            return EnsembleAgent(self.collection)
+        return MessagingAgent()
+
+    def get_agent(self, name: str) -> Agent:
+        """
+        Return the named Agent, creating it on first use and recording how long that took
+        and how much the process memory grew while it was built
+        """
+        with self.locks[name]:
+            if name not in self.agents:
+                process = psutil.Process()
+                rss = process.memory_info().rss
+                start = time.perf_counter()
+                self.agents[name] = self.create(name)
+                seconds = time.perf_counter() - start
+                rss_mb = (process.memory_info().rss - rss) / 1024 / 1024
+                self.startup_report[name] = {"seconds": seconds, "rss_mb": rss_mb}
+                self.log(f"Planning Agent created the {name} in {seconds:.1f}s, adding {rss_mb:.0f}MB")
+            return self.agents[name]
+
+    @property
+    def scanner(self) -> ScannerAgent:
+        return self.get_agent("scanner")
+
+    @property
+    def ensemble(self) -> EnsembleAgent:
+        return self.get_agent("ensemble")
+
+    @property
+    def messenger(self) -> MessagingAgent:
+        return self.get_agent("messenger")
+
+    def warm_up(self) -> None:
+        """
+        Start creating the slower Agents in a background thread, so that they load while the scanner runs
+        If this fails, the error is logged and the Agent is retried when it's first used
+        """
+        def build():
+            for name in ["ensemble", "messenger"]:
+                try:
+                    self.get_agent(name)
+                except Exception as e:
+                    self.log(f"Planning Agent could not warm up the {name}: {e}")
+
+        if self.warm_thread is None:
+            self.warm_thread = threading.Thread(target=build, name="warm-up", daemon=True)
+            self.warm_thread.start()
+
+    def report_startup(self) -> None:
+        """
+        Log the construction time and memory growth of each Agent created so far
+        Memory figures are approximate when Agents are built concurrently
+        """
+        for name, stats in self.startup_report.items():
+            self.log(f"Planning Agent startup report: {name} took {stats['seconds']:.1f}s and {stats['rss_mb']:.0f}MB")
+
+    @traced
     def run(self, deal: Deal) -> Opportunity:
         """
         Run the workflow for a particular deal
@@ -34,6 +112,22 @@ class PlanningAgent(Agent):
         self.log(f"Planning Agent has processed a deal with discount ${discount:.2f}")
         return Opportunity(deal=deal, estimate=estimate, discount=discount)
 
+    @traced
+    def run_batch(self, deals: List[Deal]) -> List[Opportunity]:
+        """
+        Run the workflow for several deals at once, pricing them as a single batch
+        :param deals: the deals, summarized from an RSS scrape
+        :returns: an opportunity for each deal, in the same order
+        """
+        self.trace(deals=len(deals))
+        self.log(f"Planning Agent is pricing up {len(deals)} potential deals")
+        estimates = self.ensemble.price_batch([deal.product_description for deal in deals])
+        opportunities = [Opportunity(deal=deal, estimate=estimate, discount=estimate - deal.price) for deal, estimate in zip(deals, estimates)]
+        for opportunity in opportunities:
+            self.log(f"Planning Agent has processed a deal with discount ${opportunity.discount:.2f}")
+        return opportunities
+
+    @traced
     def plan(self, memory: List[str] = []) -> Optional[Opportunity]:
         """
         Run the full workflow:
@@ -44,14 +138,64 @@ class PlanningAgent(Agent):
         :return: an Opportunity if one was surfaced, otherwise None
         """
         self.log("Planning Agent is kicking off a run")
+        self.warm_up()
         selection = self.scanner.scan(memory=memory)
         if selection:
-            opportunities = [self.run(deal) for deal in selection.deals[:5]]
-            opportunities.sort(key=lambda opp: opp.discount, reverse=True)
-            best = opportunities[0]
-            self.log(f"Planning Agent has identified the best deal has discount ${best.discount:.2f}")
-            if best.discount > self.DEAL_THRESHOLD:
-                self.messenger.alert(best)
-            self.log("Planning Agent has completed a run")
-            return best if best.discount > self.DEAL_THRESHOLD else None
-        return None
\ No newline at end of file
+            opportunities = self.run_batch(selection.deals[:5])
+            return self.choose(opportunities)
+        return None
+
+    def choose(self, opportunities: List[Opportunity]) -> Optional[Opportunity]:
+        """
+        Pick the opportunity with the biggest discount, and alert on it if it clears the threshold
+        :return: the best Opportunity if it clears the threshold, otherwise None
+        """
+        if not opportunities:
+            return None
+        best = max(opportunities, key=lambda opp: opp.discount)
+        self.log(f"Planning Agent has identified the best deal has discount ${best.discount:.2f}")
+        if best.discount > self.DEAL_THRESHOLD:
+            self.messenger.alert(best)
+        self.log("Planning Agent has completed a run")
+        return best if best.discount > self.DEAL_THRESHOLD else None
+
+    @traced
+    def plan_streaming(self, memory: List[str] = []) -> Optional[Opportunity]:
+        """
+        Run the full workflow, pricing each deal as soon as the ScannerAgent has streamed it,
+        while the model is still writing the rest of its selection
+        :param memory: a list of URLs that have been surfaced in the past
+        :return: an Opportunity if one was surfaced, otherwise None
+        """
+        self.log("Planning Agent is kicking off a streaming run")
+        self.warm_up()
+        with ThreadPoolExecutor(max_workers=self.PRICING_WORKERS) as executor:
+            futures = [executor.submit(in_context(self.run), deal) for deal in islice(self.scanner.scan_stream(memory=memory), 5)]
+            opportunities = [future.result() for future in futures]
+        return self.choose(opportunities)
+
+    @traced
+    def plan_pipelined(self, memory: List[str] = []) -> Optional[Opportunity]:
+        """
+        Run the full workflow as a streaming pipeline with bounded queues between the stages:
+        deal pages are scraped while earlier chunks are being summarized by the ScannerAgent,
+        and each summarized deal is priced while the next chunk is being summarized
+        The metrics of each stage are logged at the end
+        :param memory: a list of URLs that have been surfaced in the past
+        :return: an Opportunity if one was surfaced, otherwise None
+        """
+        self.log("Planning Agent is kicking off a pipelined run")
+        self.warm_up()
+        scanner = self.scanner
+        seen = scanner.seen_index(memory)
+
+        def summarize(scraped):
+            return scanner.select(scraped).deals[:self.DEALS_PER_CHUNK]
+
+        pipeline = Pipeline([
+            Stage("summarize", in_context(summarize), batch_size=self.CHUNK_SIZE),
+            Stage("price", in_context(lambda deals: [self.run(deal) for deal in deals]), workers=self.PRICING_WORKERS),
+        ])
+        opportunities = pipeline.run(ScrapedDeal.stream(seen=seen, cache=scanner.cache))
+        pipeline.log_metrics(self.log)
+        return self.choose(opportunities)
\ No newline at end of file
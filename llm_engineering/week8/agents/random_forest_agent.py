@@ -3,9 +3,11 @@
 import os
 import re
 from typing import List
-from sentence_transformers import SentenceTransformer
 import joblib
 from agents.agent import Agent
+from agents.tracing import traced
+from agents.embeddings import get_embedder
+from agents.array_forest import ArrayForest
 
 
 
@@ -17,13 +19,20 @@ class RandomForestAgent(Agent):
     def __init__(self):
         """
         Initialize this object by loading in the saved model weights
-        and the SentenceTransformer vector encoding model
+        and the shared SentenceTransformer vector encoding model
+        If the forest has been converted to flat arrays with benchmark_forest.py, they are memory mapped instead,
+        unless random_forest_model.pkl has changed since
         """
         self.log("Random Forest Agent is initializing")
-        self.vectorizer = SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2')
-        self.model = joblib.load('random_forest_model.pkl')
+        self.vectorizer = get_embedder()
+        if ArrayForest.exists():
+            self.model = ArrayForest()
+            self.log("Random Forest Agent has memory mapped the array forest")
+        else:
+            self.model = joblib.load('random_forest_model.pkl')
         self.log("Random Forest Agent is ready")
 
+    @traced
     def price(self, description: str) -> float:
         """
         Use a Random Forest model to estimate the price of the described item
@@ -34,4 +43,18 @@ class RandomForestAgent(Agent):
         vector = self.vectorizer.encode([description])
         result = max(0, self.model.predict(vector)[0])
         self.log(f"Random Forest Agent completed - predicting ${result:.2f}")
-        return result
\ No newline at end of file
+        return result
+
+    @traced
+    def price_batch(self, descriptions: List[str]) -> List[float]:
+        """
+        Estimate the prices of several items with one encoding pass and one predict
+        :param descriptions: the products to be estimated
+        :return: the prices, in the same order
+        """
+        self.log(f"Random Forest Agent is starting a prediction for {len(descriptions)} items")
+        self.trace(deals=len(descriptions))
+        vectors = self.vectorizer.encode(descriptions)
+        results = [max(0, y) for y in self.model.predict(vectors)]
+        self.log(f"Random Forest Agent completed - predicting {', '.join(f'${r:.2f}' for r in results)}")
+        return results
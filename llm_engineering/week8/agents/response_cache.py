@@ -0,0 +1,87 @@
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Dict, List, Optional
+
+CACHE_FILENAME = "response_cache.db"
+TTL = 7 * 24 * 60 * 60
+MAX_ENTRIES = 10000
+
+
+class ResponseCache:
+    """
+    A persistent cache of deterministic model replies, stored in SQLite
+    Keyed by the model name plus a hash of the messages, with a time-to-live and a cap on the number of entries
+    Also tracks hits, misses and the latency that cache hits have saved
+    """
+
+    def __init__(self, filename: str = CACHE_FILENAME, ttl: float = TTL, max_entries: int = MAX_ENTRIES):
+        """
+        :param filename: the SQLite database file
+        :param ttl: replies older than this many seconds are treated as missing
+        :param max_entries: the oldest replies are evicted beyond this many entries
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.miss_seconds = 0.0
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, reply TEXT, created REAL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_created ON responses (created)")
+        self.db.commit()
+
+    @staticmethod
+    def key(model: str, messages: List[Dict[str, str]]) -> str:
+        digest = hashlib.sha256(json.dumps(messages, sort_keys=True).encode("utf-8")).hexdigest()
+        return f"{model}:{digest}"
+
+    def get(self, model: str, messages: List[Dict[str, str]]) -> Optional[str]:
+        """
+        Return the cached reply for this prompt, or None if there isn't a fresh one
+        """
+        with self.lock:
+            row = self.db.execute(
+                "SELECT reply FROM responses WHERE key = ? AND created >= ?",
+                (self.key(model, messages), time.time() - self.ttl),
+            ).fetchone()
+            if row:
+                self.hits += 1
+                return row[0]
+            self.misses += 1
+            return None
+
+    def put(self, model: str, messages: List[Dict[str, str]], reply: str, seconds: float = 0.0) -> None:
+        """
+        Store the reply for this prompt, evicting expired and excess entries
+        :param seconds: how long the call to the model took, used to estimate the latency saved by later hits
+        """
+        with self.lock:
+            self.miss_seconds += seconds
+            self.db.execute(
+                "INSERT OR REPLACE INTO responses (key, reply, created) VALUES (?, ?, ?)",
+                (self.key(model, messages), reply, time.time()),
+            )
+            self.db.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl,))
+            self.db.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY created DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self.db.commit()
+
+    def stats(self) -> dict:
+        """
+        Return the hit rate and an estimate of the latency saved, based on the average time of a miss
+        """
+        with self.lock:
+            total = self.hits + self.misses
+            average = self.miss_seconds / self.misses if self.misses else 0.0
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "saved_seconds": self.hits * average,
+            }
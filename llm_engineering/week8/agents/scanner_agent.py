@@ -1,9 +1,68 @@
 import os
 import json
-from typing import Optional, List
+from itertools import zip_longest
+from typing import Iterator, Optional, List
+from concurrent.futures import ThreadPoolExecutor
+import tiktoken
 from openai import OpenAI
-from agents.deals import ScrapedDeal, DealSelection
+from agents.deals import ScrapedDeal, Deal, DealSelection, SeenIndex
+from agents.http_cache import HttpCache
+from agents.memory import MemoryStore
 from agents.agent import Agent
+from agents.tracing import traced, in_context
+
+
+class DealStreamParser:
+    """
+    Incrementally parses a streamed {"deals": [...]} JSON reply,
+    returning each deal object as soon as its closing brace arrives
+    """
+
+    # Nesting depth of a deal object: the outer object, then the deals array, then the deal
+    DEAL_DEPTH = 3
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.start = None
+
+    def feed(self, text: str) -> List[dict]:
+        """
+        Add the next chunk of streamed text
+        :return: the deal objects completed by this chunk
+        """
+        self.buffer += text
+        completed = []
+        while self.pos < len(self.buffer):
+            char = self.buffer[self.pos]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char in "{[":
+                self.depth += 1
+                if char == "{" and self.depth == self.DEAL_DEPTH:
+                    self.start = self.pos
+            elif char in "}]":
+                if char == "}" and self.depth == self.DEAL_DEPTH and self.start is not None:
+                    completed.append(json.loads(self.buffer[self.start:self.pos + 1]))
+                    self.start = None
+                self.depth -= 1
+            self.pos += 1
+        keep = self.start if self.start is not None else self.pos
+        self.buffer = self.buffer[keep:]
+        self.pos -= keep
+        if self.start is not None:
+            self.start = 0
+        return completed
 
 
 class ScannerAgent(Agent):
@@ -35,6 +94,22 @@ class ScannerAgent(Agent):
 
     USER_PROMPT_SUFFIX = "\n\nStrictly respond in JSON and include exactly 5 deals, no more."
 
+    SEEN_FILENAME = "seen_urls.txt"
+
+    # Token budgets for each deal in the prompt, and when to split the deals into concurrently scanned shards
+    DETAILS_TOKENS = 200
+    FEATURES_TOKENS = 100
+    SHARD_THRESHOLD = 20
+    SHARD_SIZE = 15
+    DEALS_SELECTED = 5
+
+    # Rule-based pre-ranking: how many candidates of the whole scan go to the model, and when the rules alone are confident enough
+    # The candidates are only sharded if CANDIDATES is raised above SHARD_THRESHOLD; at 12 they always go in one call
+    # Skipping the model is off by default: the rules only check for a price and a long description
+    CANDIDATES = 12
+    SKIP_MODEL_WHEN_CONFIDENT = False
+    CONFIDENT_RICHNESS = 150
+
     name = "Scanner Agent"
     color = Agent.CYAN
 
@@ -44,29 +119,63 @@ class ScannerAgent(Agent):
         """
         self.log("Scanner Agent is initializing")
         self.openai = OpenAI()
+        self.seen = SeenIndex(self.SEEN_FILENAME)
+        self.cache = HttpCache()
+        self.encoding = tiktoken.get_encoding("o200k_base")
         self.log("Scanner Agent is ready")
 
+    def seen_index(self, memory):
+        """
+        Return an index of the URLs to skip: the URL index of a MemoryStore,
+        or otherwise the seen index updated with the memory provided
+        """
+        if isinstance(memory, MemoryStore):
+            return memory.urls
+        self.seen.update(opp.deal.url for opp in memory)
+        return self.seen
+
+    @traced
     def fetch_deals(self, memory) -> List[ScrapedDeal]:
         """
         Look up deals published on RSS feeds
         Return any new deals that are not already in the memory provided
+        Deals in memory are skipped before their pages are downloaded
         """
         self.log("Scanner Agent is about to fetch deals from RSS feed")
-        urls = [opp.deal.url for opp in memory]
-        scraped = ScrapedDeal.fetch()
-        result = [scrape for scrape in scraped if scrape.url not in urls]
+        result = ScrapedDeal.fetch(seen=self.seen_index(memory), cache=self.cache)
+        self.trace(deals=len(result))
         self.log(f"Scanner Agent received {len(result)} deals not already scraped")
         return result
 
+    def trim(self, text: str, max_tokens: int) -> str:
+        """
+        Cut this text down to at most max_tokens tokens
+        """
+        tokens = self.encoding.encode(text)
+        if len(tokens) <= max_tokens:
+            return text
+        return self.encoding.decode(tokens[:max_tokens]) + "..."
+
+    def describe(self, scrape: ScrapedDeal) -> str:
+        """
+        Describe this deal for the prompt like ScrapedDeal.describe, with the details and features trimmed to their token budgets
+        Any budget the details don't use is given to the features
+        """
+        details = self.trim(scrape.details.strip(), self.DETAILS_TOKENS)
+        features_budget = self.FEATURES_TOKENS + self.DETAILS_TOKENS - len(self.encoding.encode(details))
+        features = self.trim(scrape.features.strip(), features_budget)
+        return f"Title: {scrape.title}\nDetails: {details}\nFeatures: {features}\nURL: {scrape.url}"
+
     def make_user_prompt(self, scraped) -> str:
         """
         Create a user prompt for OpenAI based on the scraped deals provided
         """
         user_prompt = self.USER_PROMPT_PREFIX
-        user_prompt += '\n\n'.join([scrape.describe() for scrape in scraped])
+        user_prompt += '\n\n'.join([self.describe(scrape) for scrape in scraped])
         user_prompt += self.USER_PROMPT_SUFFIX
         return user_prompt
 
+    @traced
     def scan(self, memory: List[str]=[]) -> Optional[DealSelection]:
         """
         Call OpenAI to provide a high potential list of deals with good descriptions and prices
@@ -76,19 +185,145 @@ class ScannerAgent(Agent):
         """
         scraped = self.fetch_deals(memory)
         if scraped:
-            user_prompt = self.make_user_prompt(scraped)
-            self.log("Scanner Agent is calling OpenAI using Structured Output")
-            result = self.openai.beta.chat.completions.parse(
-                model=self.MODEL,
-                messages=[
-                    {"role": "system", "content": self.SYSTEM_PROMPT},
-                    {"role": "user", "content": user_prompt}
-              ],
-                response_format=DealSelection
-            )
-            result = result.choices[0].message.parsed
-            result.deals = [deal for deal in result.deals if deal.price>0]
-            self.log(f"Scanner Agent received {len(result.deals)} selected deals with price>0 from OpenAI")
-            return result
+            return self.select(scraped)
         return None
+
+    def scan_stream(self, memory: List[str]=[]) -> Iterator[Deal]:
+        """
+        Like scan, but yield each selected Deal as soon as the model has finished writing it
+        :param memory: a list of URLs representing deals already raised
+        """
+        scraped = self.fetch_deals(memory)
+        if scraped:
+            yield from self.select_stream(scraped)
+
+    def pre_rank(self, scraped: List[ScrapedDeal]) -> List[ScrapedDeal]:
+        """
+        Rank the deals locally, without the model: deals with an explicit price in their title or summary first,
+        then by the richness of their description; only the top CANDIDATES are kept for the prompt
+        """
+        ranked = sorted(scraped, key=lambda scrape: (scrape.explicit_price() is not None, scrape.richness()), reverse=True)
+        candidates = ranked[:self.CANDIDATES]
+        self.log(f"Scanner Agent pre-ranked {len(scraped)} deals down to {len(candidates)} candidates")
+        return candidates
+
+    def rule_selection(self, candidates: List[ScrapedDeal]) -> Optional[DealSelection]:
+        """
+        If the top pre-ranked candidates all have an explicit price and a rich description,
+        select them directly without calling the model
+        :return: the selection, or None if the rules aren't confident
+        """
+        top = candidates[:self.DEALS_SELECTED]
+        if not self.SKIP_MODEL_WHEN_CONFIDENT or len(top) < self.DEALS_SELECTED:
+            return None
+        if any(scrape.explicit_price() is None or scrape.richness() < self.CONFIDENT_RICHNESS for scrape in top):
+            return None
+        deals = [Deal(product_description=scrape.summarize(), price=scrape.explicit_price(), url=scrape.url) for scrape in top]
+        self.log(f"Scanner Agent is confident in {len(deals)} deals from the rules alone - skipping OpenAI")
+        return DealSelection(deals=deals)
+
+    def select_stream(self, scraped: List[ScrapedDeal]) -> Iterator[Deal]:
+        """
+        Stream the Structured Output reply, parsing the deals array incrementally and yielding
+        each Deal with a price greater than 0 as soon as its JSON object closes
+        Candidates numerous enough to be sharded are selected with select, since the shards must be merged
+        """
+        scraped = self.pre_rank(scraped)
+        confident = self.rule_selection(scraped)
+        if confident:
+            yield from confident.deals
+            return
+        if len(scraped) > self.SHARD_THRESHOLD:
+            yield from self.select_candidates(scraped).deals
+            return
+        user_prompt = self.make_user_prompt(scraped)
+        self.log(f"Scanner Agent is streaming from OpenAI using Structured Output with {len(self.encoding.encode(user_prompt))} prompt tokens for {len(scraped)} deals")
+        parser = DealStreamParser()
+        count = 0
+        with self.openai.beta.chat.completions.stream(
+            model=self.MODEL,
+            messages=[
+                {"role": "system", "content": self.SYSTEM_PROMPT},
+                {"role": "user", "content": user_prompt}
+          ],
+            response_format=DealSelection
+        ) as stream:
+            for event in stream:
+                if event.type == "content.delta":
+                    for item in parser.feed(event.delta):
+                        deal = Deal(**item)
+                        if deal.price > 0:
+                            count += 1
+                            self.log(f"Scanner Agent has streamed deal {count} from OpenAI")
+                            yield deal
+        self.log(f"Scanner Agent streamed {count} selected deals with price>0 from OpenAI")
+
+    def select(self, scraped: List[ScrapedDeal]) -> DealSelection:
+        """
+        Choose and summarize the best of these scraped deals
+        The whole list is pre-ranked by local rules down to the top CANDIDATES first,
+        and if the rules are confident the model isn't called
+        :param scraped: the deals to choose from
+        :return: the selected deals with a price greater than 0
+        """
+        candidates = self.pre_rank(scraped)
+        confident = self.rule_selection(candidates)
+        if confident:
+            return confident
+        return self.select_candidates(candidates)
+
+    def select_candidates(self, candidates: List[ScrapedDeal]) -> DealSelection:
+        """
+        Send the pre-ranked candidates to the model in one call, or above SHARD_THRESHOLD candidates,
+        split them into shards that are scanned concurrently and merge the per-shard selections
+        """
+        if len(candidates) <= self.SHARD_THRESHOLD:
+            return self.select_shard(candidates)
+        shards = [candidates[i:i + self.SHARD_SIZE] for i in range(0, len(candidates), self.SHARD_SIZE)]
+        self.log(f"Scanner Agent is scanning {len(candidates)} candidates in {len(shards)} shards")
+        with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+            selections = list(executor.map(in_context(self.select_shard), shards))
+        return self.merge(selections)
+
+    def merge(self, selections: List[DealSelection]) -> DealSelection:
+        """
+        Re-rank the per-shard selections into the final list: each shard returns its deals best first,
+        so take the best of every shard, then the second best of every shard, and so on
+        """
+        deals = []
+        urls = set()
+        for rank in zip_longest(*[selection.deals for selection in selections]):
+            for deal in rank:
+                if deal and deal.url not in urls:
+                    deals.append(deal)
+                    urls.add(deal.url)
+        result = DealSelection(deals=deals[:self.DEALS_SELECTED])
+        self.log(f"Scanner Agent merged {len(deals)} deals from {len(selections)} shards into {len(result.deals)}")
+        return result
+
+    @traced
+    def select_shard(self, scraped: List[ScrapedDeal]) -> DealSelection:
+        """
+        Call OpenAI to choose and summarize the best of these scraped deals
+        Use StructuredOutputs to ensure it conforms to our specifications
+        :param scraped: the deals to choose from
+        :return: the selected deals with a price greater than 0
+        """
+        user_prompt = self.make_user_prompt(scraped)
+        prompt_tokens = len(self.encoding.encode(user_prompt))
+        self.trace(prompt_tokens=prompt_tokens, deals=len(scraped))
+        self.log(f"Scanner Agent is calling OpenAI using Structured Output with {prompt_tokens} prompt tokens for {len(scraped)} deals")
+        result = self.openai.beta.chat.completions.parse(
+            model=self.MODEL,
+            messages=[
+                {"role": "system", "content": self.SYSTEM_PROMPT},
+                {"role": "user", "content": user_prompt}
+          ],
+            response_format=DealSelection
+        )
+        result = result.choices[0].message.parsed
+        result.deals = [deal for deal in result.deals if deal.price>0]
+        self.trace(selected=len(result.deals))
+        self.log(f"Scanner Agent received {len(result.deals)} selected deals with price>0 from OpenAI")
+        return result
                 
@@ -1,5 +1,7 @@
+from typing import List
 import modal
 from agents.agent import Agent
+from agents.tracing import traced
 
 
 class SpecialistAgent(Agent):
@@ -10,15 +12,19 @@ class SpecialistAgent(Agent):
     name = "Specialist Agent"
     color = Agent.RED
 
-    def __init__(self):
+    def __init__(self, pricer=None):
         """
         Set up this Agent by creating an instance of the modal class
+        :param pricer: an object with the remote Pricer's interface to use instead, such as a local stand-in
         """
-        self.log("Specialist Agent is initializing - connecting to modal")
-        Pricer = modal.Cls.lookup("pricer-service", "Pricer")
-        self.pricer = Pricer()
+        if pricer is None:
+            self.log("Specialist Agent is initializing - connecting to modal")
+            Pricer = modal.Cls.lookup("pricer-service", "Pricer")
+            pricer = Pricer()
+        self.pricer = pricer
         self.log("Specialist Agent is ready")
         
+    @traced
     def price(self, description: str) -> float:
         """
         Make a remote call to return the estimate of the price of this item
@@ -27,3 +33,14 @@ class SpecialistAgent(Agent):
         result = self.pricer.price.remote(description)
         self.log(f"Specialist Agent completed - predicting ${result:.2f}")
         return result
+
+    @traced
+    def price_batch(self, descriptions: List[str]) -> List[float]:
+        """
+        Price several items with one fan-out to the remote model, returning results in order
+        """
+        self.log(f"Specialist Agent is calling remote fine-tuned model for {len(descriptions)} items")
+        self.trace(deals=len(descriptions))
+        results = list(self.pricer.price.map(descriptions))
+        self.log(f"Specialist Agent completed - predicting {', '.join(f'${r:.2f}' for r in results)}")
+        return results
@@ -0,0 +1,227 @@
+import os
+import json
+import time
+import itertools
+import threading
+import functools
+import inspect
+import contextvars
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+TRACE_FILENAME = "traces.jsonl"
+METRICS_FILENAME = "metrics.prom"
+TRACE_CAPACITY = 10000
+# How many recent durations of each operation the quantiles in the metrics file are computed from
+QUANTILE_WINDOW = 1000
+
+_current: contextvars.ContextVar = contextvars.ContextVar("span", default=None)
+
+
+class Span:
+    """
+    One timed operation of an Agent, with the sizes of what it worked on, such as tokens or deals
+    Spans opened while another is open in the same context are its children
+    """
+
+    def __init__(self, id: int, agent: str, operation: str, parent: Optional["Span"], sizes: dict):
+        self.id = id
+        self.trace_id = parent.trace_id if parent else id
+        self.parent_id = parent.id if parent else None
+        self.agent = agent
+        self.operation = operation
+        self.sizes = dict(sizes)
+        self.started = time.time()
+        self.start = time.perf_counter()
+        self.seconds = 0.0
+        self.error: Optional[str] = None
+
+    def set(self, **sizes) -> None:
+        self.sizes.update(sizes)
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.id,
+            "parent_id": self.parent_id,
+            "agent": self.agent,
+            "operation": self.operation,
+            "started": self.started,
+            "seconds": self.seconds,
+            "sizes": self.sizes,
+            "error": self.error,
+        }
+
+
+def percentile(values: List[float], q: float) -> float:
+    """
+    Return the q quantile of the values by the nearest rank, or 0 if there are none
+    """
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+class Tracer:
+    """
+    Collects finished spans in a bounded buffer until they are drained at the end of a run,
+    and keeps running totals per operation for the Prometheus-style metrics file
+    """
+
+    def __init__(self, capacity: int = TRACE_CAPACITY):
+        self.spans = deque(maxlen=capacity)
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.counts = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.totals = defaultdict(float)
+        self.sizes = defaultdict(float)
+        self.recent = defaultdict(lambda: deque(maxlen=QUANTILE_WINDOW))
+
+    @contextmanager
+    def span(self, agent: str, operation: str, **sizes):
+        """
+        Time the body of a with-block as a span, nested inside the span already open in this context
+        """
+        with self.lock:
+            id = next(self.ids)
+        span = Span(id, agent, operation, _current.get(), sizes)
+        token = _current.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = repr(e)
+            raise
+        finally:
+            span.seconds = time.perf_counter() - span.start
+            _current.reset(token)
+            self.record(span)
+
+    def record(self, span: Span) -> None:
+        key = (span.agent, span.operation)
+        with self.lock:
+            self.spans.append(span)
+            self.counts[key] += 1
+            self.totals[key] += span.seconds
+            self.recent[key].append(span.seconds)
+            if span.error:
+                self.errors[key] += 1
+            for name, value in span.sizes.items():
+                if isinstance(value, (int, float)):
+                    self.sizes[key + (name,)] += value
+
+    def drain(self) -> List[Span]:
+        """
+        Return the spans finished since the last drain, and forget them
+        """
+        with self.lock:
+            spans = list(self.spans)
+            self.spans.clear()
+        return spans
+
+    @staticmethod
+    def summary(spans: List[Span]) -> Dict[tuple, dict]:
+        """
+        Return the count, total, p50 and p95 seconds of each agent's operations in these spans
+        """
+        durations = defaultdict(list)
+        for span in spans:
+            durations[(span.agent, span.operation)].append(span.seconds)
+        return {
+            key: {"count": len(values), "total": sum(values), "p50": percentile(values, 0.5), "p95": percentile(values, 0.95)}
+            for key, values in sorted(durations.items())
+        }
+
+    @staticmethod
+    def export_jsonl(spans: List[Span], filename: str = TRACE_FILENAME) -> None:
+        """
+        Append these spans to a JSON Lines file, one span per line
+        """
+        with open(filename, "a") as file:
+            for span in spans:
+                file.write(json.dumps(span.to_dict()) + "\n")
+
+    def export_prometheus(self, filename: str = METRICS_FILENAME) -> None:
+        """
+        Write the running totals in the Prometheus text exposition format, replacing the file atomically
+        so that a node exporter's textfile collector never reads it half written
+        """
+        def labels(agent, operation, **extra):
+            pairs = {"agent": agent, "operation": operation, **extra}
+            return "{" + ",".join(f'{k}="{v}"' for k, v in pairs.items()) + "}"
+
+        lines = [
+            "# HELP agent_operation_seconds Time spent in each operation of each Agent",
+            "# TYPE agent_operation_seconds summary",
+        ]
+        with self.lock:
+            for key in sorted(self.counts):
+                recent = list(self.recent[key])
+                for q in ["0.5", "0.95"]:
+                    lines.append(f"agent_operation_seconds{labels(*key, quantile=q)} {percentile(recent, float(q)):.6f}")
+                lines.append(f"agent_operation_seconds_sum{labels(*key)} {self.totals[key]:.6f}")
+                lines.append(f"agent_operation_seconds_count{labels(*key)} {self.counts[key]}")
+            lines += ["# HELP agent_operation_errors_total Operations that raised an exception",
+                      "# TYPE agent_operation_errors_total counter"]
+            lines += [f"agent_operation_errors_total{labels(*key)} {self.errors[key]}" for key in sorted(self.counts)]
+            lines += ["# HELP agent_operation_size_total Sizes worked on by each operation, such as tokens or deals",
+                      "# TYPE agent_operation_size_total counter"]
+            lines += [f"agent_operation_size_total{labels(agent, operation, size=name)} {value:g}"
+                      for (agent, operation, name), value in sorted(self.sizes.items())]
+        temporary = filename + ".tmp"
+        with open(temporary, "w") as file:
+            file.write("\n".join(lines) + "\n")
+        os.replace(temporary, filename)
+
+
+_tracer: Optional[Tracer] = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer() -> Tracer:
+    """
+    Return the process-wide Tracer
+    """
+    global _tracer
+    with _tracer_lock:
+        if _tracer is None:
+            _tracer = Tracer()
+        return _tracer
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+def traced(method):
+    """
+    Decorate a method of an Agent so that each call is recorded as a span named after the method
+    The span of a generator method lasts until the generator is exhausted
+    """
+    if inspect.isgeneratorfunction(method):
+        @functools.wraps(method)
+        def generator(self, *args, **kwargs):
+            with get_tracer().span(self.name, method.__name__):
+                yield from method(self, *args, **kwargs)
+        return generator
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with get_tracer().span(self.name, method.__name__):
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+def in_context(function):
+    """
+    Bind a function to the current context, so that spans it opens on a worker thread nest under the current span
+    Each call runs in its own copy of the context, so the function can run on several threads at once
+    """
+    context = contextvars.copy_context()
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        return context.copy().run(function, *args, **kwargs)
+    return wrapper
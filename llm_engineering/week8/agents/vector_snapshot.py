@@ -0,0 +1,205 @@
+import os
+import mmap
+import numpy as np
+from typing import List, Optional, Tuple
+
+SNAPSHOT_DIR = "products_snapshot"
+ARRAYS = ["embeddings", "norms", "prices", "offsets"]
+COUNT_ARRAY = "count"
+INDEX_ARRAYS = ["centroids", "order", "starts"]
+EXPORT_PAGE = 5000
+CHUNK_ROWS = 65536
+KMEANS_SAMPLE = 50000
+KMEANS_ITERATIONS = 10
+# IVF lists benchmark_snapshot.py scans by default; searches are exact unless given an nprobe
+NPROBE = 8
+
+
+def squared_distances(queries: np.ndarray, vectors: np.ndarray, norms: np.ndarray) -> np.ndarray:
+    """
+    Return the squared L2 distance from each query to each vector, computed in float32,
+    using the precomputed squared norms of the vectors
+    """
+    queries = np.asarray(queries, dtype=np.float32)
+    q_norms = (queries * queries).sum(axis=1)[:, None]
+    return q_norms + norms[None, :] - 2 * queries @ np.asarray(vectors, dtype=np.float32).T
+
+
+def kmeans(vectors: np.ndarray, clusters: int, iterations: int = KMEANS_ITERATIONS, seed: int = 42) -> np.ndarray:
+    """
+    Lloyd's algorithm on a sample of the vectors, returning the centroids
+    """
+    rng = np.random.default_rng(seed)
+    sample = vectors[np.sort(rng.choice(len(vectors), size=min(len(vectors), KMEANS_SAMPLE), replace=False))]
+    sample = np.asarray(sample, dtype=np.float32)
+    centroids = sample[rng.choice(len(sample), size=clusters, replace=False)]
+    for _ in range(iterations):
+        nearest = squared_distances(sample, centroids, (centroids * centroids).sum(axis=1)).argmin(axis=1)
+        for c in range(clusters):
+            members = sample[nearest == c]
+            if len(members):
+                centroids[c] = members.mean(axis=0)
+    return centroids
+
+
+def export(collection, directory: str = SNAPSHOT_DIR, dtype: str = "float32", clusters: int = 0) -> int:
+    """
+    Write a read-only snapshot of a Chroma collection: the embedding matrix, the prices from the metadata,
+    and the documents as one UTF-8 file with an array of offsets into it
+    The collection's count is saved too, so that readers can tell when the snapshot is out of date
+    :param collection: the Chroma collection, for example 'products' in products_vectorstore
+    :param directory: the folder to write the snapshot to
+    :param dtype: float32, or float16 to halve the size of the embedding matrix
+    :param clusters: if more than 0, also build an IVF index with this many lists
+    :return: the number of items in the snapshot
+    """
+    os.makedirs(directory, exist_ok=True)
+    count = collection.count()
+    embeddings, prices, offsets = [], [], [0]
+    with open(os.path.join(directory, "documents.txt"), "wb") as documents:
+        for offset in range(0, count, EXPORT_PAGE):
+            page = collection.get(include=['embeddings', 'documents', 'metadatas'], limit=EXPORT_PAGE, offset=offset)
+            embeddings.append(np.asarray(page['embeddings'], dtype=np.float32))
+            prices.extend(metadata['price'] for metadata in page['metadatas'])
+            for document in page['documents']:
+                encoded = document.encode("utf-8")
+                documents.write(encoded)
+                offsets.append(offsets[-1] + len(encoded))
+    vectors = np.concatenate(embeddings).astype(dtype)
+    arrays = {
+        "embeddings": vectors,
+        "norms": (vectors.astype(np.float32) ** 2).sum(axis=1),
+        "prices": np.array(prices, dtype=np.float64),
+        "offsets": np.array(offsets, dtype=np.int64),
+        "count": np.array([count], dtype=np.int64),
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(directory, f"{name}.npy"), np.ascontiguousarray(array))
+    for name in INDEX_ARRAYS:
+        path = os.path.join(directory, f"{name}.npy")
+        if os.path.exists(path):
+            os.remove(path)
+    if clusters:
+        build_index(directory, clusters)
+    return len(vectors)
+
+
+def build_index(directory: str = SNAPSHOT_DIR, clusters: int = 1024) -> None:
+    """
+    Add an IVF index to a snapshot: the vectors are clustered with k-means,
+    and the item numbers are stored grouped by their nearest centroid
+    """
+    vectors = np.load(os.path.join(directory, "embeddings.npy"), mmap_mode="r")
+    centroids = kmeans(vectors, clusters)
+    c_norms = (centroids * centroids).sum(axis=1)
+    assignments = np.concatenate([
+        squared_distances(vectors[i:i + CHUNK_ROWS], centroids, c_norms).argmin(axis=1)
+        for i in range(0, len(vectors), CHUNK_ROWS)
+    ])
+    order = np.argsort(assignments, kind="stable").astype(np.int64)
+    starts = np.searchsorted(assignments[order], np.arange(clusters + 1)).astype(np.int64)
+    for name, array in {"centroids": centroids, "order": order, "starts": starts}.items():
+        np.save(os.path.join(directory, f"{name}.npy"), np.ascontiguousarray(array))
+
+
+class VectorSnapshot:
+    """
+    A read-only, memory mapped copy of the products collection, queried in-process without Chroma
+    Searches are exact by default; with an IVF index and an nprobe, only the nearest lists are scanned
+    """
+
+    def __init__(self, directory: str = SNAPSHOT_DIR, mmap_arrays: bool = True):
+        """
+        :param directory: the folder holding the snapshot
+        :param mmap_arrays: memory map the arrays rather than reading them into memory
+        """
+        mode = "r" if mmap_arrays else None
+        for name in ARRAYS:
+            setattr(self, name, np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mode))
+        self.indexed = all(os.path.exists(os.path.join(directory, f"{name}.npy")) for name in INDEX_ARRAYS)
+        if self.indexed:
+            for name in INDEX_ARRAYS:
+                setattr(self, name, np.load(os.path.join(directory, f"{name}.npy")))
+            self.c_norms = (self.centroids * self.centroids).sum(axis=1)
+        self.count = int(np.load(os.path.join(directory, f"{COUNT_ARRAY}.npy"))[0])
+        self.file = open(os.path.join(directory, "documents.txt"), "rb")
+        self.documents = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.offsets[-1] else b""
+
+    @staticmethod
+    def exists(directory: str = SNAPSHOT_DIR) -> bool:
+        files = [f"{name}.npy" for name in ARRAYS + [COUNT_ARRAY]] + ["documents.txt"]
+        return all(os.path.exists(os.path.join(directory, file)) for file in files)
+
+    def __len__(self) -> int:
+        return len(self.embeddings)
+
+    def document(self, i: int) -> str:
+        return self.documents[self.offsets[i]:self.offsets[i + 1]].decode("utf-8")
+
+    def exact(self, queries: np.ndarray, n_results: int) -> np.ndarray:
+        """
+        Return the item numbers of the nearest n_results items for each query, scanning every vector
+        """
+        best = np.empty((len(queries), 0), dtype=np.int64)
+        best_distances = np.empty((len(queries), 0), dtype=np.float32)
+        for i in range(0, len(self), CHUNK_ROWS):
+            distances = squared_distances(queries, self.embeddings[i:i + CHUNK_ROWS], self.norms[i:i + CHUNK_ROWS])
+            indices = np.broadcast_to(np.arange(i, i + distances.shape[1]), distances.shape)
+            best = np.concatenate([best, indices], axis=1)
+            best_distances = np.concatenate([best_distances, distances], axis=1)
+            if best.shape[1] > n_results:
+                keep = np.argpartition(best_distances, n_results - 1, axis=1)[:, :n_results]
+                best = np.take_along_axis(best, keep, axis=1)
+                best_distances = np.take_along_axis(best_distances, keep, axis=1)
+        ranks = np.argsort(best_distances, axis=1, kind="stable")
+        return np.take_along_axis(best, ranks, axis=1)
+
+    def candidates(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        """
+        Return the item numbers in the nprobe IVF lists whose centroids are nearest the query
+        """
+        distances = squared_distances(query[None, :], self.centroids, self.c_norms)[0]
+        lists = np.argpartition(distances, min(nprobe, len(distances)) - 1)[:nprobe]
+        return np.concatenate([self.order[self.starts[c]:self.starts[c + 1]] for c in lists])
+
+    def matches(self, collection) -> bool:
+        """
+        Return whether the snapshot was exported from the collection as it is now, judged by its count
+        """
+        return self.count == collection.count()
+
+    def approximate(self, queries: np.ndarray, n_results: int, nprobe: int) -> np.ndarray:
+        """
+        Search the nearest IVF lists, returning the n_results candidates nearest each query
+        Falls back to an exact scan for any query whose lists hold fewer than n_results items
+        """
+        results = []
+        for query in queries:
+            candidates = np.sort(self.candidates(query, nprobe))
+            if len(candidates) < n_results:
+                results.append(self.exact(query[None, :], n_results)[0])
+                continue
+            distances = squared_distances(query[None, :], self.embeddings[candidates], self.norms[candidates])[0]
+            nearest = np.argpartition(distances, n_results - 1)[:n_results]
+            results.append(candidates[nearest[np.argsort(distances[nearest], kind="stable")]])
+        return np.array(results, dtype=np.int64).reshape(len(queries), n_results)
+
+    def search(self, queries, n_results: int = 5, nprobe: Optional[int] = None) -> np.ndarray:
+        """
+        Return the item numbers of the nearest n_results items for each query vector, nearest first
+        :param nprobe: how many IVF lists to scan if there's an index, or None for an exact search
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        n_results = min(n_results, len(self))
+        if self.indexed and nprobe:
+            return self.approximate(queries, n_results, nprobe)
+        return self.exact(queries, n_results)
+
+    def query(self, queries, n_results: int = 5, nprobe: Optional[int] = None) -> Tuple[List[List[str]], List[List[float]]]:
+        """
+        Return the documents and prices of the nearest items for each query vector, like a Chroma query
+        """
+        indices = self.search(queries, n_results, nprobe)
+        documents = [[self.document(i) for i in row] for row in indices]
+        prices = [[float(self.prices[i]) for i in row] for row in indices]
+        return documents, prices
@@ -0,0 +1,50 @@
+import time
+import argparse
+import numpy as np
+import pandas as pd
+import joblib
+from agents.ensemble_agent import EnsembleAgent
+
+MODEL_FILENAME = "ensemble_model.pkl"
+
+
+def time_per_call(function, repeats: int) -> float:
+    function()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        function()
+    return (time.perf_counter() - start) / repeats * 1_000_000
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Compare the ensemble's sklearn predict with its NumPy fast path")
+    parser.add_argument("--repeats", type=int, default=2000, help="calls to time for each path")
+    parser.add_argument("--batch-size", type=int, default=5, help="rows in the batched comparison")
+    args = parser.parse_args()
+
+    model = joblib.load(MODEL_FILENAME)
+    coefficients, intercept = EnsembleAgent.extract_weights(model)
+    rng = np.random.default_rng(42)
+    estimates = rng.uniform(1, 1000, size=(args.batch_size, 3))
+    X = np.column_stack([estimates, estimates.min(axis=1), estimates.max(axis=1)])
+    frame = pd.DataFrame(X, columns=EnsembleAgent.FEATURES)
+
+    difference = np.abs(model.predict(frame) - (X @ coefficients + intercept)).max()
+    print(f"Largest difference between sklearn and NumPy: {difference:.2e}")
+    assert np.allclose(model.predict(frame), X @ coefficients + intercept), "NumPy weights don't match the model"
+
+    def sklearn_single():
+        return model.predict(pd.DataFrame(X[:1], columns=EnsembleAgent.FEATURES))[0]
+
+    def numpy_single():
+        return float(X[0] @ coefficients + intercept)
+
+    def sklearn_batch():
+        return model.predict(pd.DataFrame(X, columns=EnsembleAgent.FEATURES))
+
+    def numpy_batch():
+        return X @ coefficients + intercept
+
+    for name, function in [("sklearn single", sklearn_single), ("numpy single", numpy_single),
+                           ("sklearn batch", sklearn_batch), ("numpy batch", numpy_batch)]:
+        print(f"{name:>15}: {time_per_call(function, args.repeats):8.1f}us per call")
@@ -0,0 +1,77 @@
+import sys
+import json
+import time
+import argparse
+import subprocess
+import numpy as np
+import psutil
+import joblib
+from agents.array_forest import FOREST_DIR, ArrayForest, convert
+
+MODEL_FILENAME = "random_forest_model.pkl"
+DIMENSIONS = 384
+
+
+def load(kind: str):
+    if kind == "sklearn":
+        return joblib.load(MODEL_FILENAME)
+    return ArrayForest(FOREST_DIR)
+
+
+def measure(kind: str, repeats: int, batch_size: int) -> dict:
+    """
+    Load one kind of forest in this process and time it; run in a fresh subprocess so RSS figures are independent
+    """
+    process = psutil.Process()
+    rss = process.memory_info().rss
+    start = time.perf_counter()
+    model = load(kind)
+    load_seconds = time.perf_counter() - start
+    rng = np.random.default_rng(42)
+    single = rng.normal(size=(1, DIMENSIONS)).astype(np.float32)
+    batch = rng.normal(size=(batch_size, DIMENSIONS)).astype(np.float32)
+    model.predict(single)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        model.predict(single)
+    single_ms = (time.perf_counter() - start) / repeats * 1000
+    start = time.perf_counter()
+    model.predict(batch)
+    batch_ms = (time.perf_counter() - start) / batch_size * 1000
+    return {
+        "kind": kind,
+        "load_seconds": load_seconds,
+        "rss_mb": (process.memory_info().rss - rss) / 1024 / 1024,
+        "single_ms": single_ms,
+        "batch_ms_per_row": batch_ms,
+    }
+
+
+def check(rows: int) -> float:
+    """
+    Return the largest difference between the sklearn and array forest predictions on random vectors
+    """
+    X = np.random.default_rng(0).normal(size=(rows, DIMENSIONS)).astype(np.float32)
+    return float(np.abs(load("sklearn").predict(X) - load("arrays").predict(X)).max())
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Convert the random forest to flat arrays and compare it with sklearn")
+    parser.add_argument("--convert", action="store_true", help=f"write {FOREST_DIR} from {MODEL_FILENAME} first")
+    parser.add_argument("--repeats", type=int, default=100, help="single predictions to time")
+    parser.add_argument("--batch-size", type=int, default=256, help="rows in the batch prediction")
+    parser.add_argument("--measure", choices=["sklearn", "arrays"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(measure(args.measure, args.repeats, args.batch_size)))
+        sys.exit()
+    if args.convert or not ArrayForest.exists(FOREST_DIR, MODEL_FILENAME):
+        print(f"Converting {MODEL_FILENAME} to {FOREST_DIR}")
+        convert(joblib.load(MODEL_FILENAME), FOREST_DIR, MODEL_FILENAME)
+    print(f"Largest difference in predictions: {check(args.batch_size):.2e}")
+    for kind in ["sklearn", "arrays"]:
+        command = [sys.executable, __file__, "--measure", kind, "--repeats", str(args.repeats), "--batch-size", str(args.batch_size)]
+        result = json.loads(subprocess.run(command, capture_output=True, text=True, check=True).stdout)
+        print(f"{kind:>8}: load {result['load_seconds']:.3f}s, RSS +{result['rss_mb']:.0f}MB, "
+              f"single {result['single_ms']:.2f}ms, batch {result['batch_ms_per_row']:.3f}ms per row")
@@ -0,0 +1,351 @@
+import os
+import re
+import sys
+import json
+import time
+import random
+import hashlib
+import logging
+import argparse
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+import chromadb
+from agents import deals
+from agents.agent import Agent
+from agents.deals import SeenIndex
+from agents.http_cache import HttpCache
+from agents.response_cache import ResponseCache
+from agents.tracing import get_tracer, percentile, traced
+from agents.planning_agent import PlanningAgent
+from agents.scanner_agent import ScannerAgent
+from agents.ensemble_agent import EnsembleAgent
+
+DB = "products_vectorstore"
+BASELINE_FILENAME = "benchmark_plan_baseline.json"
+FEEDS = 5
+WORDS = ["compact", "wireless", "stainless", "portable", "smart", "rechargeable", "ergonomic", "digital", "heavy-duty",
+         "adjustable", "bluetooth", "cordless", "premium", "waterproof", "LED", "quiet", "foldable", "programmable"]
+NOUNS = ["speaker", "blender", "drill", "monitor", "router", "headphones", "vacuum", "camera", "keyboard", "charger",
+         "lamp", "thermostat", "grill", "backpack", "tire inflator", "dash cam", "air fryer", "power station"]
+
+
+def seeded(*parts) -> random.Random:
+    return random.Random(hashlib.sha1(":".join(map(str, parts)).encode("utf-8")).hexdigest())
+
+
+def estimate(text: str) -> float:
+    """
+    A deterministic stand-in price for a product description
+    """
+    return round(seeded(text).uniform(20, 800), 2)
+
+
+class Fixtures(BaseHTTPRequestHandler):
+    """
+    Serves generated RSS feeds at /feed/<round>/<n> and deal pages at /deal/<round>/<n>/<i>
+    Each round has different deals, so every benchmark run starts with cold caches like a fresh scrape
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def deal(self, round: int, feed: int, i: int) -> dict:
+        rng = seeded(round, feed, i)
+        title = f"{rng.choice(WORDS).title()} {rng.choice(WORDS)} {rng.choice(NOUNS)} model {rng.randint(100, 999)}"
+        if rng.random() < 0.5:
+            title += f" for ${rng.randint(10, 900)}"
+        words = lambda n: " ".join(rng.choice(WORDS + NOUNS) for _ in range(n))
+        details = " ".join(f"{words(12).capitalize()}." for _ in range(max(1, self.server.words // 12)))
+        features = " ".join(f"{words(6).capitalize()}." for _ in range(3))
+        return {"title": title, "summary": words(20), "details": details, "features": features,
+                "url": f"http://{self.headers['Host']}/deal/{round}/{feed}/{i}"}
+
+    def feed(self, round: int, feed: int) -> str:
+        items = []
+        for i in range(self.server.entries):
+            deal = self.deal(round, feed, i)
+            items.append(f"<item><title>{deal['title']}</title><link>{deal['url']}</link>"
+                         f"<description><![CDATA[<div class=\"snippet summary\">{deal['summary']}</div>]]></description></item>")
+        return f"<?xml version=\"1.0\"?><rss version=\"2.0\"><channel><title>Fixture feed {feed}</title>{''.join(items)}</channel></rss>"
+
+    def page(self, round: int, feed: int, i: int) -> str:
+        deal = self.deal(round, feed, i)
+        return (f"<html><body><h1>{deal['title']}</h1><div class=\"content-section\">\n{deal['details']}\n"
+                f"Features\n{deal['features']}\nmore</div></body></html>")
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        parts = self.path.strip("/").split("/")
+        try:
+            if parts[0] == "feed":
+                body, kind = self.feed(int(parts[1]), int(parts[2])), "application/rss+xml"
+            elif parts[0] == "deal":
+                body, kind = self.page(int(parts[1]), int(parts[2]), int(parts[3])), "text/html"
+                with self.server.lock:
+                    self.server.pages += 1
+            else:
+                raise ValueError(self.path)
+        except (ValueError, IndexError):
+            self.send_error(404)
+            return
+        data = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", kind)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class FakeOpenAI(BaseHTTPRequestHandler):
+    """
+    An OpenAI-compatible chat completions endpoint that answers after a configurable latency
+    Structured Output requests get the first 5 deals in the prompt; other requests get a price
+    Streaming requests are answered with server-sent events
+    """
+
+    protocol_version = "HTTP/1.1"
+    DEAL = re.compile(r"Title: (.*)\nDetails: (.*)\nFeatures: .*\nURL: (\S+)")
+    PRICE = re.compile(r"\$(\d+(?:\.\d+)?)")
+
+    def log_message(self, format, *args):
+        pass
+
+    def content(self, request: dict) -> str:
+        prompt = request["messages"][-1]["content"] if request["messages"][-1]["role"] == "user" else request["messages"][-2]["content"]
+        if not request.get("response_format"):
+            return f"{estimate(prompt):.2f}"
+        selected = []
+        for title, details, url in self.DEAL.findall(prompt)[:5]:
+            price = self.PRICE.search(title)
+            selected.append({"product_description": f"{title}. {details[:300]}",
+                             "price": float(price.group(1)) if price else estimate(title), "url": url})
+        return json.dumps({"deals": selected})
+
+    def completion(self, request: dict, **fields) -> dict:
+        return {"id": "chatcmpl-fake", "created": int(time.time()), "model": request.get("model", "fake"),
+                "system_fingerprint": "fake", **fields}
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        content = self.content(request)
+        if not request.get("stream"):
+            time.sleep(self.server.latency)
+            data = json.dumps(self.completion(
+                request, object="chat.completion",
+                choices=[{"index": 0, "message": {"role": "assistant", "content": content, "refusal": None},
+                          "finish_reason": "stop", "logprobs": None}],
+                usage={"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            )).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+        # Half the latency before the first token, and the rest spread over the reply
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        time.sleep(self.server.latency / 2)
+        pieces = [content[i:i + 20] for i in range(0, len(content), 20)]
+        for piece in pieces:
+            time.sleep(self.server.latency / 2 / len(pieces))
+            self.event(self.completion(request, object="chat.completion.chunk", choices=[
+                {"index": 0, "delta": {"role": "assistant", "content": piece}, "finish_reason": None, "logprobs": None}]))
+        self.event(self.completion(request, object="chat.completion.chunk", choices=[
+            {"index": 0, "delta": {}, "finish_reason": "stop", "logprobs": None}]))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def event(self, chunk: dict) -> None:
+        self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        self.wfile.flush()
+
+
+def serve(handler, latency: float, **settings) -> ThreadingHTTPServer:
+    """
+    Start a local server for this handler on a free port, in a background thread
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.lock = threading.Lock()
+    for name, value in settings.items():
+        setattr(server, name, value)
+    threading.Thread(target=server.serve_forever, name=handler.__name__, daemon=True).start()
+    return server
+
+
+class FakeMethod:
+    """
+    Stands in for a Modal method, with remote for one call and map for a parallel fan-out
+    """
+
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def remote(self, description: str) -> float:
+        time.sleep(self.latency)
+        return estimate(description)
+
+    def map(self, descriptions: List[str]) -> List[float]:
+        time.sleep(self.latency)
+        return [estimate(description) for description in descriptions]
+
+
+class FakePricer:
+    """
+    A local stand-in for the Pricer class deployed on Modal
+    """
+
+    def __init__(self, latency: float):
+        self.price = FakeMethod(latency)
+
+
+class NullMessenger(Agent):
+    """
+    Counts alerts instead of sending them
+    """
+
+    name = "Messaging Agent"
+    color = Agent.WHITE
+
+    def __init__(self):
+        self.alerts = 0
+
+    @traced
+    def alert(self, opportunity) -> None:
+        self.alerts += 1
+
+
+class BenchmarkPlanner(PlanningAgent):
+    """
+    A Planning Agent whose Agents use the local stand-ins and keep their caches in a scratch folder
+    """
+
+    def __init__(self, collection, pricer: FakePricer, scratch: str):
+        self.pricer = pricer
+        self.scratch = scratch
+        super().__init__(collection)
+
+    def create(self, name: str) -> Agent:
+        if name == "scanner":
+            scanner = ScannerAgent()
+            scanner.seen = SeenIndex()
+            scanner.cache = HttpCache(os.path.join(self.scratch, "http_cache"))
+            return scanner
+        if name == "ensemble":
+            ensemble = EnsembleAgent(self.collection, pricer=self.pricer)
+            ensemble.frontier.cache = ResponseCache(os.path.join(self.scratch, "response_cache.db"))
+            return ensemble
+        return NullMessenger()
+
+
+def measure(planner: BenchmarkPlanner, fixtures: ThreadingHTTPServer, mode: str, runs: int) -> dict:
+    """
+    Run the planner over a fresh round of fixture deals for each run, and summarize the traced spans
+    """
+    plan = {"batch": planner.plan, "pipelined": planner.plan_pipelined, "streaming": planner.plan_streaming}[mode]
+    host = f"http://127.0.0.1:{fixtures.server_address[1]}"
+    tracer = get_tracer()
+    tracer.drain()
+    seconds, rates, spans = [], [], []
+    for run in range(runs):
+        deals.feeds[:] = [f"{host}/feed/{run}/{n}" for n in range(FEEDS)]
+        fixtures.pages = 0
+        start = time.perf_counter()
+        plan(memory=[])
+        elapsed = time.perf_counter() - start
+        seconds.append(elapsed)
+        rates.append(fixtures.pages / elapsed * 60)
+        spans += tracer.drain()
+        print(f"Run {run + 1}: {elapsed:.2f}s, {fixtures.pages} deal pages, {rates[-1]:.0f} deals/minute")
+    stages = {f"{agent} {operation}": stats for (agent, operation), stats in tracer.summary(spans).items()}
+    return {
+        "end_to_end_p50": percentile(seconds, 0.5),
+        "end_to_end_p95": percentile(seconds, 0.95),
+        "deals_per_minute": sum(rates) / len(rates),
+        "stages": stages,
+    }
+
+
+def report(result: dict) -> None:
+    print(f"\nEnd to end: p50 {result['end_to_end_p50']:.2f}s, p95 {result['end_to_end_p95']:.2f}s, "
+          f"{result['deals_per_minute']:.0f} deals/minute")
+    for stage, stats in result["stages"].items():
+        print(f"{stage:>42}: {stats['count']:4d} calls, p50 {stats['p50']:.3f}s, p95 {stats['p95']:.3f}s")
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> bool:
+    """
+    Print the change from the baseline in each figure, flagging slowdowns beyond the tolerance
+    :return: True if end to end latency and throughput are within the tolerance of the baseline
+    """
+    if baseline["config"] != result["config"]:
+        print(f"\nWarning: the baseline was measured with different settings: {baseline['config']}")
+    print("\nCompared with the baseline:")
+    ok = True
+    # (name, baseline, current, whether higher is better, whether a regression fails the comparison)
+    figures = [("end to end p50", baseline["end_to_end_p50"], result["end_to_end_p50"], False, True),
+               ("end to end p95", baseline["end_to_end_p95"], result["end_to_end_p95"], False, False),
+               ("deals/minute", baseline["deals_per_minute"], result["deals_per_minute"], True, True)]
+    figures += [(f"{stage} p50", baseline["stages"][stage]["p50"], stats["p50"], False, False)
+                for stage, stats in result["stages"].items() if stage in baseline["stages"]]
+    for name, before, after, higher_is_better, gating in figures:
+        change = (after - before) / before if before else 0.0
+        worse = -change if higher_is_better else change
+        regression = worse > tolerance
+        if regression and gating:
+            ok = False
+        print(f"{name:>46}: {before:10.3f} -> {after:10.3f} ({change:+.1%}){'  REGRESSION' if regression else ''}")
+    return ok
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Benchmark PlanningAgent.plan offline, with local stand-ins for "
+                                                 "dealnews, OpenAI, the Modal Pricer and Pushover")
+    parser.add_argument("--mode", default="batch", choices=["batch", "pipelined", "streaming"], help="how the planner runs")
+    parser.add_argument("--runs", type=int, default=3, help="planning runs to time, each over fresh deals")
+    parser.add_argument("--entries", type=int, default=deals.ENTRIES_PER_FEED, help="deals in each of the fixture feeds")
+    parser.add_argument("--words", type=int, default=80, help="words of details on each deal page")
+    parser.add_argument("--page-latency", type=float, default=0.05, help="seconds the fixture server takes per request")
+    parser.add_argument("--openai-latency", type=float, default=0.5, help="seconds the fake OpenAI endpoint takes per request")
+    parser.add_argument("--pricer-latency", type=float, default=0.3, help="seconds the fake Pricer takes per call")
+    parser.add_argument("--baseline", default=BASELINE_FILENAME, help="JSON file of a saved baseline to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="save these results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="fractional slowdown reported as a regression")
+    parser.add_argument("--verbose", action="store_true", help="show the Agents' logs")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    fixtures = serve(Fixtures, args.page_latency, entries=args.entries, words=args.words, pages=0)
+    openai = serve(FakeOpenAI, args.openai_latency)
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{openai.server_address[1]}/v1"
+    os.environ["OPENAI_API_KEY"] = "fake"
+
+    with tempfile.TemporaryDirectory() as scratch:
+        collection = chromadb.PersistentClient(path=DB).get_or_create_collection('products')
+        planner = BenchmarkPlanner(collection, FakePricer(args.pricer_latency), scratch)
+        start = time.perf_counter()
+        for name in PlanningAgent.AGENTS:
+            planner.get_agent(name)
+        print(f"Created the Agents in {time.perf_counter() - start:.1f}s")
+        result = measure(planner, fixtures, args.mode, args.runs)
+
+    result["config"] = {name: value for name, value in vars(args).items()
+                        if name in ["mode", "entries", "words", "page_latency", "openai_latency", "pricer_latency"]}
+    report(result)
+    if args.save_baseline:
+        with open(args.baseline, "w") as file:
+            json.dump(result, file, indent=2)
+        print(f"\nSaved the baseline to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        sys.exit(0 if compare(result, baseline, args.tolerance) else 1)
@@ -0,0 +1,68 @@
+import time
+import argparse
+import numpy as np
+import chromadb
+from agents.vector_snapshot import SNAPSHOT_DIR, NPROBE, VectorSnapshot, export
+
+DB = "products_vectorstore"
+
+
+def recall(results: list, truths: list) -> float:
+    """
+    Return the average fraction of the true nearest documents found in each result
+    """
+    return float(np.mean([len(set(result) & set(truth)) / len(truth) for result, truth in zip(results, truths)]))
+
+
+def timed(function, queries: np.ndarray) -> tuple:
+    """
+    Run the search one query at a time, returning the results and the milliseconds per query
+    """
+    start = time.perf_counter()
+    results = [function(query[None, :])[0] for query in queries]
+    return results, (time.perf_counter() - start) / len(queries) * 1000
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Export the products collection to a snapshot and compare it with Chroma")
+    parser.add_argument("--export", action="store_true", help=f"write {SNAPSHOT_DIR} from {DB} first")
+    parser.add_argument("--dtype", default="float32", choices=["float32", "float16"], help="embedding precision when exporting")
+    parser.add_argument("--clusters", type=int, default=1024, help="IVF lists when exporting, or 0 for exact search only")
+    parser.add_argument("--nprobe", type=int, default=NPROBE, help="IVF lists scanned per query")
+    parser.add_argument("--queries", type=int, default=200, help="queries to time")
+    parser.add_argument("--n-results", type=int, default=5, help="neighbours per query")
+    args = parser.parse_args()
+
+    collection = chromadb.PersistentClient(path=DB).get_or_create_collection('products')
+    if args.export or not VectorSnapshot.exists() or not VectorSnapshot().matches(collection):
+        print(f"Exporting {DB} to {SNAPSHOT_DIR} as {args.dtype} with {args.clusters} IVF lists")
+        start = time.perf_counter()
+        count = export(collection, SNAPSHOT_DIR, args.dtype, args.clusters)
+        print(f"Exported {count:,} products in {time.perf_counter() - start:.1f}s")
+    start = time.perf_counter()
+    snapshot = VectorSnapshot()
+    print(f"Opened a snapshot of {len(snapshot):,} products in {(time.perf_counter() - start) * 1000:.1f}ms")
+
+    # Queries are stored products with some noise, so they land among real neighbours without being exact matches
+    rng = np.random.default_rng(42)
+    queries = np.asarray(snapshot.embeddings[rng.choice(len(snapshot), size=args.queries, replace=False)], dtype=np.float32)
+    queries += rng.normal(scale=0.02, size=queries.shape).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    k = args.n_results
+
+    def chroma(query):
+        return collection.query(query_embeddings=query.tolist(), n_results=k)['documents']
+
+    searches = {
+        "chroma": chroma,
+        "snapshot exact": lambda query: snapshot.query(query, k, nprobe=None)[0],
+    }
+    if snapshot.indexed:
+        searches[f"snapshot ivf nprobe={args.nprobe}"] = lambda query: snapshot.query(query, k, nprobe=args.nprobe)[0]
+    truths = snapshot.query(queries, k, nprobe=None)[0]
+    for name, function in searches.items():
+        results, ms = timed(function, queries)
+        batch_start = time.perf_counter()
+        function(queries)
+        batch_ms = (time.perf_counter() - batch_start) / len(queries) * 1000
+        print(f"{name:>24}: recall@{k} {recall(results, truths):.3f}, single {ms:.2f}ms, batch {batch_ms:.3f}ms per query")
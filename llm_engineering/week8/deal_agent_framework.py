@@ -1,13 +1,12 @@
 import os
 import sys
 import logging
-import json
-from typing import List, Optional
 from twilio.rest import Client
 from dotenv import load_dotenv
 import chromadb
 from agents.planning_agent import PlanningAgent
-from agents.deals import Opportunity
+from agents.memory import MemoryStore, open_memory
+from agents.tracing import get_tracer
 from sklearn.manifold import TSNE
 import numpy as np
 
@@ -38,6 +37,11 @@ class DealAgentFramework:
 
     DB = "products_vectorstore"
     MEMORY_FILENAME = "memory.json"
+    MEMORY_BACKEND = "sqlite"
+    # How the planner runs: "batch", "pipelined" or "streaming"
+    PLAN_MODE = "batch"
+    TRACE_FILENAME = "traces.jsonl"
+    METRICS_FILENAME = "metrics.prom"
 
     def __init__(self):
         init_logging()
@@ -46,51 +50,95 @@ class DealAgentFramework:
         self.memory = self.read_memory()
         self.collection = client.get_or_create_collection('products')
         self.planner = None
+        self.startup_reported = False
 
     def init_agents_as_needed(self):
         if not self.planner:
             self.log("Initializing Agent Framework")
             self.planner = PlanningAgent(self.collection)
+            self.planner.warm_up()
             self.log("Agent Framework is ready")
         
-    def read_memory(self) -> List[Opportunity]:
-        if os.path.exists(self.MEMORY_FILENAME):
-            with open(self.MEMORY_FILENAME, "r") as file:
-                data = json.load(file)
-            opportunities = [Opportunity(**item) for item in data]
-            return opportunities
-        return []
-
-    def write_memory(self) -> None:
-        data = [opportunity.dict() for opportunity in self.memory]
-        with open(self.MEMORY_FILENAME, "w") as file:
-            json.dump(data, file, indent=2)
+    def read_memory(self) -> MemoryStore:
+        """
+        Open the memory store, which loads Opportunities lazily a page at a time
+        The legacy memory.json file is imported the first time
+        """
+        return open_memory(self.MEMORY_BACKEND, legacy_filename=self.MEMORY_FILENAME)
 
     def log(self, message: str):
         text = BG_BLUE + WHITE + "[Agent Framework] " + message + RESET
         logging.info(text)
 
-    def run(self) -> List[Opportunity]:
+    def run(self) -> MemoryStore:
         self.init_agents_as_needed()
         logging.info("Kicking off Planning Agent")
-        result = self.planner.plan(memory=self.memory)
+        try:
+            with get_tracer().span("Agent Framework", "run", mode=self.PLAN_MODE):
+                if self.PLAN_MODE == "pipelined":
+                    result = self.planner.plan_pipelined(memory=self.memory)
+                elif self.PLAN_MODE == "streaming":
+                    result = self.planner.plan_streaming(memory=self.memory)
+                else:
+                    result = self.planner.plan(memory=self.memory)
+        finally:
+            self.report_traces()
         logging.info(f"Planning Agent has completed and returned: {result}")
+        if not self.startup_reported:
+            self.planner.report_startup()
+            self.startup_reported = True
         if result:
             self.memory.append(result)
-            self.write_memory()
         return self.memory
 
+    def report_traces(self) -> None:
+        """
+        Export the spans traced during this run and log the p50 and p95 time of each Agent operation
+        """
+        tracer = get_tracer()
+        spans = tracer.drain()
+        tracer.export_jsonl(spans, self.TRACE_FILENAME)
+        tracer.export_prometheus(self.METRICS_FILENAME)
+        for (agent, operation), stats in tracer.summary(spans).items():
+            self.log(f"Trace {agent} {operation}: {stats['count']} calls, p50 {stats['p50']:.2f}s, "
+                     f"p95 {stats['p95']:.2f}s, total {stats['total']:.1f}s")
+
+    @classmethod
+    def project(cls, vectors: np.ndarray, method: str) -> np.ndarray:
+        """
+        Reduce the vectors to 3 dimensions, either with TSNE or with a fast PCA for a first paint
+        """
+        if method == "pca":
+            centered = vectors - vectors.mean(axis=0)
+            _, _, components = np.linalg.svd(centered, full_matrices=False)
+            return centered @ components[:3].T
+        tsne = TSNE(n_components=3, random_state=42, n_jobs=-1)
+        return tsne.fit_transform(vectors)
+
     @classmethod
-    def get_plot_data(cls, max_datapoints=10000):
+    def get_plot_data(cls, max_datapoints=10000, method="tsne"):
+        """
+        Return the documents, 3D projection and colors for the vectorstore plot
+        The projection is saved alongside the vectorstore, keyed by the collection count,
+        and only recomputed when the collection changes
+        :param max_datapoints: the maximum number of points to plot
+        :param method: tsne for the full projection, or pca for a fast approximation
+        """
         client = chromadb.PersistentClient(path=cls.DB)
         collection = client.get_or_create_collection('products')
+        count = collection.count()
+        cache_path = os.path.join(cls.DB, f"plot_{method}_{max_datapoints}.npz")
+        if os.path.exists(cache_path):
+            cached = np.load(cache_path)
+            if int(cached['count']) == count:
+                return list(cached['documents']), cached['vectors'], list(cached['colors'])
         result = collection.get(include=['embeddings', 'documents', 'metadatas'], limit=max_datapoints)
         vectors = np.array(result['embeddings'])
         documents = result['documents']
-        categories = [metadata['category'] for metadata in result['metadatas']]
-        colors = [COLORS[CATEGORIES.index(c)] for c in categories]
-        tsne = TSNE(n_components=3, random_state=42, n_jobs=-1)
-        reduced_vectors = tsne.fit_transform(vectors)
+        color_for = dict(zip(CATEGORIES, COLORS))
+        colors = [color_for[metadata['category']] for metadata in result['metadatas']]
+        reduced_vectors = cls.project(vectors, method)
+        np.savez(cache_path, count=count, documents=np.array(documents), vectors=reduced_vectors, colors=np.array(colors))
         return documents, reduced_vectors, colors
 
 
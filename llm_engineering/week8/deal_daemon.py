@@ -0,0 +1,103 @@
+import json
+import time
+import random
+import signal
+import logging
+import argparse
+import threading
+from datetime import datetime
+from deal_agent_framework import DealAgentFramework
+
+INTERVAL = 300
+JITTER = 0.1
+STATS_FILENAME = "daemon_stats.jsonl"
+
+
+class DealDaemon:
+    """
+    Runs the Deal Agent Framework headless and forever, without Gradio
+    The framework and its Agents are created once and kept for the life of the process
+    """
+
+    def __init__(self, interval: float = INTERVAL, jitter: float = JITTER, stats_filename: str = STATS_FILENAME,
+                 plan_mode: str = "batch"):
+        """
+        :param interval: the average number of seconds between the start of each cycle
+        :param jitter: the fraction by which each interval is randomly lengthened or shortened
+        :param stats_filename: the JSON Lines file that gets one line of timing stats per cycle
+        :param plan_mode: how the planner runs: batch, pipelined or streaming
+        """
+        self.interval = interval
+        self.jitter = jitter
+        self.stats_filename = stats_filename
+        self.stopping = threading.Event()
+        self.cycles = 0
+        self.framework = DealAgentFramework()
+        self.framework.PLAN_MODE = plan_mode
+
+    def stop(self, signum=None, frame=None) -> None:
+        """
+        Ask the daemon to stop once the current cycle has finished
+        """
+        logging.info("Deal daemon is shutting down after the current cycle")
+        self.stopping.set()
+
+    def next_wait(self, elapsed: float) -> float:
+        """
+        Return how long to sleep before the next cycle, with jitter so that polls don't line up
+        """
+        interval = self.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+        return max(0.0, interval - elapsed)
+
+    def cycle(self) -> dict:
+        """
+        Run the framework once and record how it went
+        """
+        self.cycles += 1
+        size_before = len(self.framework.memory)
+        started = datetime.now().isoformat()
+        start = time.perf_counter()
+        error = None
+        try:
+            self.framework.run()
+        except Exception as e:
+            logging.exception("Deal daemon cycle failed")
+            error = repr(e)
+        stats = {
+            "cycle": self.cycles,
+            "started": started,
+            "seconds": time.perf_counter() - start,
+            "new_opportunities": len(self.framework.memory) - size_before,
+            "memory_size": len(self.framework.memory),
+            "error": error,
+        }
+        with open(self.stats_filename, "a") as file:
+            file.write(json.dumps(stats) + "\n")
+        return stats
+
+    def run(self, once: bool = False) -> None:
+        """
+        Run cycles until stopped by SIGINT or SIGTERM
+        :param once: run a single cycle and return
+        """
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+        self.framework.init_agents_as_needed()
+        while not self.stopping.is_set():
+            stats = self.cycle()
+            logging.info(f"Deal daemon cycle {stats['cycle']} took {stats['seconds']:.1f}s")
+            if once:
+                break
+            self.stopping.wait(self.next_wait(stats['seconds']))
+        logging.info("Deal daemon has stopped")
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Run the Deal Agent Framework as a headless service")
+    parser.add_argument("--interval", type=float, default=INTERVAL, help="average seconds between cycles")
+    parser.add_argument("--jitter", type=float, default=JITTER, help="random fraction to vary each interval by")
+    parser.add_argument("--stats-file", default=STATS_FILENAME, help="JSON Lines file for per-cycle timing stats")
+    parser.add_argument("--mode", default="batch", choices=["batch", "pipelined", "streaming"], help="how the planner runs")
+    parser.add_argument("--once", action="store_true", help="run a single cycle and exit")
+    args = parser.parse_args()
+    DealDaemon(args.interval, args.jitter, args.stats_file, args.mode).run(once=args.once)
@@ -0,0 +1,62 @@
+import pickle
+import argparse
+from dotenv import load_dotenv
+import chromadb
+from items import Item
+from testing import Tester
+from agents.ensemble_agent import EnsembleAgent
+
+DB = "products_vectorstore"
+TEST_FILENAME = "test.pkl"
+
+
+def description(item: Item) -> str:
+    return item.prompt.split("to the nearest dollar?\n\n")[1].split("\n\nPrice is $")[0]
+
+
+def score(guesses: list, data: list, title: str) -> dict:
+    """
+    Run the Tester over guesses that have already been made, returning its metrics without the chart
+    """
+    answers = iter(guesses)
+    tester = Tester(lambda item: next(answers), data, title=title, size=len(guesses))
+    for i in range(len(guesses)):
+        tester.run_datapoint(i)
+    return tester.metrics()
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Compare the full ensemble with its kNN and Random Forest cascade over the Tester data")
+    parser.add_argument("--size", type=int, default=250, help="test items to price")
+    parser.add_argument("--batch-size", type=int, default=10, help="items priced by the full ensemble at a time")
+    parser.add_argument("--tolerances", type=float, nargs="+", default=[0.05, 0.1, 0.15, 0.2, 0.3],
+                        help="agreement tolerances to evaluate the cascade at")
+    args = parser.parse_args()
+
+    load_dotenv()
+    with open(TEST_FILENAME, "rb") as file:
+        test = pickle.load(file)[:args.size]
+    collection = chromadb.PersistentClient(path=DB).get_or_create_collection('products')
+    ensemble = EnsembleAgent(collection)
+
+    # Every member prices every item once; each cascade tolerance is then evaluated from the same estimates
+    texts = [description(item) for item in test]
+    full = [y for i in range(0, len(texts), args.batch_size) for y in ensemble.price_all(texts[i:i + args.batch_size])]
+    knns = ensemble.knn.price_batch(texts)
+    random_forests = ensemble.random_forest.price_batch(texts)
+
+    baseline = score(full, test, "Ensemble")
+    results = []
+    for tolerance in args.tolerances:
+        EnsembleAgent.CASCADE_TOLERANCE = tolerance
+        cheap = [ensemble.confident(knn, rf) for knn, rf in zip(knns, random_forests)]
+        guesses = [y if c is None else c for y, c in zip(full, cheap)]
+        saved = sum(c is not None for c in cheap) / len(cheap)
+        results.append((tolerance, saved, score(guesses, test, f"Cascade {tolerance:.0%}")))
+
+    print(f"\nFull ensemble: error ${baseline['average_error']:,.2f}, RMSLE {baseline['rmsle']:.3f}, hits {baseline['hit_rate']:.1%}")
+    for tolerance, saved, metrics in results:
+        print(f"Cascade at {tolerance:.0%}: skips Specialist and Frontier for {saved:.1%} of deals, "
+              f"error ${metrics['average_error']:,.2f} ({metrics['average_error'] - baseline['average_error']:+,.2f}), "
+              f"RMSLE {metrics['rmsle']:.3f} ({metrics['rmsle'] - baseline['rmsle']:+.3f}), "
+              f"hits {metrics['hit_rate']:.1%} ({(metrics['hit_rate'] - baseline['hit_rate']) * 100:+.1f} points)")
@@ -1,3 +1,8 @@
+import logging
+import threading
+from collections import deque
+from typing import List, Optional
+
 # Foreground colors
 RED = '\033[31m'
 GREEN = '\033[32m'
@@ -31,5 +36,66 @@ def reformat(message):
         message = message.replace(key, f'<span style="color: {value}">')
     message = message.replace(RESET, '</span>')
     return message
-    
-    
\ No newline at end of file
+
+
+LOG_CAPACITY = 200
+
+
+class LogBus(logging.Handler):
+    """
+    A single long-lived logging handler that keeps the most recent lines, already reformatted as HTML,
+    in a bounded ring buffer, and lets readers block until something new arrives instead of polling
+    """
+
+    def __init__(self, capacity: int = LOG_CAPACITY):
+        super().__init__()
+        self.lines = deque(maxlen=capacity)
+        self.seq = 0
+        self.condition = threading.Condition()
+        self.setFormatter(logging.Formatter("[%(asctime)s] %(message)s", datefmt="%Y-%m-%d %H:%M:%S %z"))
+
+    def emit(self, record):
+        line = reformat(self.format(record))
+        with self.condition:
+            self.lines.append(line)
+            self.seq += 1
+            self.condition.notify_all()
+
+    def notify(self):
+        """
+        Wake any waiting readers without adding a line, for example when a result is ready
+        """
+        with self.condition:
+            self.condition.notify_all()
+
+    def wait(self, after: int, timeout: Optional[float] = None) -> int:
+        """
+        Block until a line beyond sequence number `after` is logged, notify is called, or the timeout passes
+        :return: the latest sequence number
+        """
+        with self.condition:
+            if self.seq <= after:
+                self.condition.wait(timeout)
+            return self.seq
+
+    def recent(self, count: int) -> List[str]:
+        with self.condition:
+            return list(self.lines)[-count:]
+
+
+_bus: Optional[LogBus] = None
+_bus_lock = threading.Lock()
+
+
+def get_log_bus() -> LogBus:
+    """
+    Return the LogBus, attaching it to the root logger the first time only
+    """
+    global _bus
+    with _bus_lock:
+        if _bus is None:
+            _bus = LogBus()
+            logger = logging.getLogger()
+            logger.addHandler(_bus)
+            logger.setLevel(logging.INFO)
+        return _bus
@@ -1,52 +1,40 @@
-import logging
-import queue
-import threading
 import time
 import gradio as gr
 from deal_agent_framework import DealAgentFramework
 from agents.deals import Opportunity, Deal
-from log_utils import reformat
+from log_utils import get_log_bus
+from run_coordinator import RunCoordinator, RunHandle
 import plotly.graph_objects as go
 
 
-class QueueHandler(logging.Handler):
-    def __init__(self, log_queue):
-        super().__init__()
-        self.log_queue = log_queue
-
-    def emit(self, record):
-        self.log_queue.put(self.format(record))
+# Cap on how often the log panel is re-rendered; lines arriving in between are batched
+MAX_FPS = 4
+LOG_LINES = 18
 
 def html_for(log_data):
-    output = '<br>'.join(log_data[-18:])
+    output = '<br>'.join(log_data[-LOG_LINES:])
     return f"""
     <div id="scrollContent" style="height: 400px; overflow-y: auto; border: 1px solid #ccc; background-color: #222229; padding: 10px;">
     {output}
     </div>
     """
 
-def setup_logging(log_queue):
-    handler = QueueHandler(log_queue)
-    formatter = logging.Formatter(
-        "[%(asctime)s] %(message)s",
-        datefmt="%Y-%m-%d %H:%M:%S %z",
-    )
-    handler.setFormatter(formatter)
-    logger = logging.getLogger()
-    logger.addHandler(handler)
-    logger.setLevel(logging.INFO)
-                
 
 class App:
 
     def __init__(self):    
         self.agent_framework = None
+        self.log_bus = get_log_bus()
+        self.coordinator = RunCoordinator(self.do_run, on_done=self.log_bus.notify)
 
     def get_agent_framework(self):
         if not self.agent_framework:
             self.agent_framework = DealAgentFramework()
         return self.agent_framework
 
+    def do_run(self):
+        return self.get_agent_framework().run()
+
     def run(self):
         with gr.Blocks(title="The Price is Right", fill_width=True) as ui:
             
@@ -55,22 +43,25 @@ class App:
             def table_for(opps):
                 return [[opp.deal.product_description, f"${opp.deal.price:.2f}", f"${opp.estimate:.2f}", f"${opp.discount:.2f}", opp.deal.url] for opp in opps]
 
-            def update_output(log_data, log_queue, result_queue):
+            def update_output(handle: RunHandle):
+                """
+                Block on the log bus until new lines or the result arrive, then re-render at most MAX_FPS times a second
+                """
                 initial_result = table_for(self.get_agent_framework().memory)
                 final_result = None
-                while True:
-                    try:
-                        message = log_queue.get_nowait()
-                        log_data.append(reformat(message))
-                        yield log_data, html_for(log_data), final_result or initial_result
-                    except queue.Empty:
-                        try:
-                            final_result = result_queue.get_nowait()
-                            yield log_data, html_for(log_data), final_result or initial_result
-                        except queue.Empty:
-                            if final_result is not None:
-                                break
-                            time.sleep(0.1)
+                seq = self.log_bus.seq
+                last_render = 0.0
+                while final_result is None:
+                    latest = self.log_bus.wait(seq, timeout=1.0)
+                    if handle.done.is_set():
+                        final_result = table_for(handle.result) if handle.result is not None else initial_result
+                    elif latest == seq:
+                        continue
+                    time.sleep(max(0.0, last_render + 1.0 / MAX_FPS - time.monotonic()))
+                    seq = self.log_bus.seq
+                    log_data = self.log_bus.recent(LOG_LINES)
+                    last_render = time.monotonic()
+                    yield log_data, html_for(log_data), final_result or initial_result
 
             def get_initial_plot():
                 fig = go.Figure()
@@ -80,8 +71,8 @@ class App:
                 )
                 return fig
 
-            def get_plot():
-                documents, vectors, colors = DealAgentFramework.get_plot_data(max_datapoints=1000)
+            def get_plot(method="tsne"):
+                documents, vectors, colors = DealAgentFramework.get_plot_data(max_datapoints=1000, method=method)
                 # Create the 3D scatter plot
                 fig = go.Figure(data=[go.Scatter3d(
                     x=vectors[:, 0],
@@ -106,24 +97,9 @@ class App:
 
                 return fig
         
-            def do_run():
-                new_opportunities = self.get_agent_framework().run()
-                table = table_for(new_opportunities)
-                return table
-
             def run_with_logging(initial_log_data):
-                log_queue = queue.Queue()
-                result_queue = queue.Queue()
-                setup_logging(log_queue)
-                
-                def worker():
-                    result = do_run()
-                    result_queue.put(result)
-                
-                thread = threading.Thread(target=worker)
-                thread.start()
-                
-                for log_data, output, final_result in update_output(initial_log_data, log_queue, result_queue):
+                handle = self.coordinator.trigger()
+                for log_data, output, final_result in update_output(handle):
                     yield log_data, output, final_result
 
             def do_select(selected_index: gr.SelectData):
@@ -149,9 +125,10 @@ class App:
                 with gr.Column(scale=1):
                     logs = gr.HTML()
                 with gr.Column(scale=1):
-                    plot = gr.Plot(value=get_plot(), show_label=False)
+                    plot = gr.Plot(value=get_plot(method="pca"), show_label=False)
         
             ui.load(run_with_logging, inputs=[log_data], outputs=[log_data, logs, opportunities_dataframe])
+            ui.load(get_plot, inputs=[], outputs=[plot])
 
             timer = gr.Timer(value=300, active=True)
             timer.tick(run_with_logging, inputs=[log_data], outputs=[log_data, logs, opportunities_dataframe])
@@ -0,0 +1,100 @@
+import time
+import logging
+import threading
+from collections import deque
+from typing import Any, Callable, Optional
+
+
+class RunHandle:
+    """
+    A single in-flight run, shared by every trigger that arrived while it was going
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+        self.started = time.monotonic()
+        self.finished: Optional[float] = None
+        self.subscribers = 1
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Block until the run completes or the timeout passes
+        :return: True if the run has completed
+        """
+        return self.done.wait(timeout)
+
+    @property
+    def seconds(self) -> float:
+        return (self.finished or time.monotonic()) - self.started
+
+
+class RunCoordinator:
+    """
+    Makes sure only one run happens at a time
+    A trigger while a run is in flight doesn't start another run; it subscribes to the current one instead
+    """
+
+    def __init__(self, run: Callable[[], Any], on_done: Optional[Callable[[], None]] = None, history: int = 50):
+        """
+        :param run: the function that performs a run and returns its result
+        :param on_done: an optional callback made after each run completes, successfully or not
+        :param history: how many run durations to keep for the stats
+        """
+        self.run = run
+        self.on_done = on_done
+        self.lock = threading.Lock()
+        self.current: Optional[RunHandle] = None
+        self.durations = deque(maxlen=history)
+        self.runs = 0
+        self.coalesced = 0
+
+    def trigger(self) -> RunHandle:
+        """
+        Start a run, or join the one already in flight
+        :return: the handle to wait on for the result
+        """
+        with self.lock:
+            if self.current and not self.current.done.is_set():
+                self.current.subscribers += 1
+                self.coalesced += 1
+                logging.info(f"Run already in progress for {self.current.seconds:.0f}s - joining it with {self.current.subscribers} subscribers")
+                return self.current
+            handle = RunHandle()
+            self.current = handle
+            self.runs += 1
+        threading.Thread(target=self.execute, args=(handle,), name="run", daemon=True).start()
+        return handle
+
+    def execute(self, handle: RunHandle) -> None:
+        try:
+            handle.result = self.run()
+        except BaseException as e:
+            handle.error = e
+            logging.exception("Run failed")
+        finally:
+            handle.finished = time.monotonic()
+            with self.lock:
+                self.durations.append(handle.seconds)
+            handle.done.set()
+            stats = self.stats()
+            logging.info(f"Run completed in {handle.seconds:.1f}s for {handle.subscribers} subscribers; "
+                         f"{stats['runs']} runs so far averaging {stats['average_seconds']:.1f}s, {stats['coalesced']} triggers coalesced")
+            if self.on_done:
+                self.on_done()
+
+    def stats(self) -> dict:
+        """
+        Return whether a run is in flight, how many triggers are waiting on it, and the run durations
+        """
+        with self.lock:
+            in_flight = bool(self.current and not self.current.done.is_set())
+            return {
+                "in_flight": in_flight,
+                "queue_depth": self.current.subscribers if in_flight else 0,
+                "runs": self.runs,
+                "coalesced": self.coalesced,
+                "last_seconds": self.durations[-1] if self.durations else 0.0,
+                "average_seconds": sum(self.durations) / len(self.durations) if self.durations else 0.0,
+            }
@@ -57,11 +57,15 @@ class Tester:
         plt.title(title)
         plt.show()
 
-    def report(self):
+    def metrics(self):
         average_error = sum(self.errors) / self.size
         rmsle = math.sqrt(sum(self.sles) / self.size)
         hits = sum(1 for color in self.colors if color=="green")
-        title = f"{self.title} Error=${average_error:,.2f} RMSLE={rmsle:,.2f} Hits={hits/self.size*100:.1f}%"
+        return {"average_error": average_error, "rmsle": rmsle, "hit_rate": hits / self.size}
+
+    def report(self):
+        metrics = self.metrics()
+        title = f"{self.title} Error=${metrics['average_error']:,.2f} RMSLE={metrics['rmsle']:,.2f} Hits={metrics['hit_rate']*100:.1f}%"
         self.chart(title)
 
     def run(self):